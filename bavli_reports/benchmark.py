@@ -0,0 +1,234 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import List, Tuple, Dict, Iterator
+
+from bavli_reports import ROOT_DIR
+from bavli_reports.google_connection import extract_values
+from bavli_reports.local_sheets import LocalSpreadsheet
+from bavli_reports.models import BackgroundColor, RowDiffs
+from bavli_reports.normalization import normalize_values
+from bavli_reports.report_worker import scan_by_key, group_values, get_formatting_settings
+
+HEADER = ["name", "house", "zip", "apartment", "notes"]
+SIZES = [1_000, 100_000, 1_000_000]
+# a stage counts as a regression when it got this much slower than the baseline
+REGRESSION_THRESHOLD = 1.2
+# what the GUI imports before its window shows up, and how long that may take
+STARTUP_MODULE = "main"
+STARTUP_BUDGET = 0.2
+
+
+def generate_sheets(
+        rows: int,
+        rows_per_key: int = 20,
+        duplicate_rate: float = 0.01,
+        invalid_rate: float = 0.01,
+        mismatch_rate: float = 0.05,
+        outlier_rate: float = 0.02,
+        seed: int = 0
+) -> Tuple[List[List[str]], List[List[str]]]:
+    """Builds a bavli and an external sheet (header and the two trailing summary rows included) with about `rows`
+    rows each, `rows_per_key` rows per (house, zip) building, and the given rates of duplicated, invalid,
+    mismatching and one-sided rows
+
+    Half of the mismatching rows have an external apartment with nothing to match it, the other half have a typo
+    in it that only a fuzzy run pairs back up. As many rows again match but differ in their notes.
+    """
+    rng = random.Random(seed)
+    bavli: List[List[str]] = [HEADER]
+    external: List[List[str]] = [HEADER]
+
+    for i in range(rows):
+        house, zip_code = str(i // rows_per_key), str(1000 + (i // rows_per_key) % 97)
+        row = [f"tenant {i}", house, zip_code, f"apartment {i % rows_per_key}", "ok"]
+        if rng.random() < invalid_rate:
+            row[1] = f"{house}A"
+
+        bavli_row, external_row = row, list(row)
+        # the apartment is the column rows are matched on
+        mismatch = rng.random()
+        if mismatch < mismatch_rate / 2:
+            external_row[3] = f"storage {i}"
+        elif mismatch < mismatch_rate:
+            external_row[3] = _typo(rng, external_row[3])
+        elif rng.random() < mismatch_rate:
+            external_row[4] = "check"
+        if rng.random() < outlier_rate:
+            external_row[1] = str(rows + i)
+
+        bavli.append(bavli_row)
+        external.append(external_row)
+        if rng.random() < duplicate_rate:
+            bavli.append(list(bavli_row))
+
+    # the external sheet lists the same rows in a different order
+    external_body = external[1:]
+    rng.shuffle(external_body)
+    footer = [["total", "", ""], ["generated", "", ""]]
+    return bavli + footer, [HEADER] + external_body + footer
+
+
+def _typo(rng: random.Random, text: str) -> str:
+    """`text` with two neighbouring letters of its first word swapped"""
+    word_length = text.find(" ") if " " in text else len(text)
+    i = rng.randrange(word_length - 1)
+    if text[i] == text[i + 1]:
+        # swapping the same letter changes nothing, drop one of them instead
+        return text[:i] + text[i + 1:]
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+@contextmanager
+def measure(results: Dict[str, Dict], stage: str, track_memory: bool) -> Iterator[None]:
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        results[stage] = {"seconds": round(time.perf_counter() - start, 4)}
+        if track_memory:
+            results[stage]["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+            tracemalloc.stop()
+
+
+def run_benchmark(rows: int, track_memory: bool = True, fuzzy: bool = False, **generator_kwargs) -> Dict[str, Dict]:
+    bavli_rows, external_rows = generate_sheets(rows, **generator_kwargs)
+    bavli_sheet = LocalSpreadsheet(title="bavli").add_worksheet("bavli", values=bavli_rows)
+    external_sheet = LocalSpreadsheet(title="external").add_worksheet("external", values=external_rows)
+    del bavli_rows, external_rows
+
+    results: Dict[str, Dict] = {}
+    with measure(results, "extract_values", track_memory):
+        bavli_values, bavli_invalids = extract_values(bavli_sheet, "bavli")
+        external_values, external_invalids = extract_values(external_sheet, "external")
+
+    if fuzzy:
+        with measure(results, "normalize_values", track_memory):
+            bavli_values, _ = normalize_values(bavli_values, bavli_invalids)
+            external_values, _ = normalize_values(external_values, external_invalids)
+
+    with measure(results, "scan_by_key", track_memory):
+        mismatches: Dict = {}
+        all_matches: List[RowDiffs] = []
+        for k in bavli_values.keys() & external_values.keys():
+            misses, matches = scan_by_key(k, [bavli_values[k], external_values[k]], fuzzy)
+            mismatches.update(misses)
+            all_matches.extend(matches)
+
+    with measure(results, "group_values", track_memory):
+        grouped = group_values(mismatches)
+
+    with measure(results, "get_formatting_settings", track_memory):
+        get_formatting_settings(grouped.rows, (BackgroundColor.RED, BackgroundColor.LIGHT_RED), grouped.group_ends)
+
+    return results
+
+
+def measure_startup(module: str = STARTUP_MODULE, slowest: int = 5) -> Dict[str, Dict]:
+    """How long importing `module` takes in a fresh interpreter, along with its `slowest` imports"""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, capture_output=True, text=True, check=True
+    ).stderr
+
+    # `import time: <self us> | <cumulative us> | <module name, indented under whatever imported it>`, a module
+    # comes after everything it imported, so `module`'s imports are the ones since the previous top level import
+    imported: Dict[str, int] = {}
+    total = 0
+    for line in output.splitlines():
+        parts = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        if len(parts[2]) - len(parts[2].lstrip()) > 1:
+            imported[name] = int(parts[1])
+        elif name == module:
+            total = int(parts[1])
+            break
+        else:
+            imported = {}
+
+    heaviest = sorted(imported, key=imported.get, reverse=True)[:slowest]
+    return {f"import {module}": {
+        "seconds": round(total / 1e6, 4),
+        "slowest": {name: round(imported[name] / 1e6, 4) for name in heaviest},
+    }}
+
+
+def compare(results: Dict[str, Dict[str, Dict]], baseline: Dict[str, Dict[str, Dict]]) -> List[str]:
+    regressions = []
+    for size, stages in results.items():
+        for stage, measured in stages.items():
+            before = baseline.get(size, {}).get(stage)
+            if before and measured["seconds"] > before["seconds"] * REGRESSION_THRESHOLD:
+                regressions.append(f"{stage} @ {size} rows: {before['seconds']}s -> {measured['seconds']}s")
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Time every stage of the reconciliation pipeline on synthetic sheets")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=SIZES, help="rows per sheet to run with")
+    parser.add_argument("--rows-per-key", type=int, default=20)
+    parser.add_argument("--duplicate-rate", type=float, default=0.01)
+    parser.add_argument("--invalid-rate", type=float, default=0.01)
+    parser.add_argument("--mismatch-rate", type=float, default=0.05)
+    parser.add_argument("--outlier-rate", type=float, default=0.02)
+    parser.add_argument("--fuzzy", action="store_true", help="normalize keys and match names by edit distance")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, it slows everything down")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="where to record the results")
+    parser.add_argument("-b", "--baseline", help="earlier results to compare against")
+    parser.add_argument(
+        "--startup", action="store_true", help=f"also time how long importing the GUI takes (at most {STARTUP_BUDGET}s)"
+    )
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Dict[str, Dict]] = {}
+    slow_startup = False
+    if args.startup:
+        results["startup"] = measure_startup()
+        for stage, measured in results["startup"].items():
+            print(f"{'startup':>14}  {stage:<25} {measured['seconds']:>8.3f}s")
+            for name, seconds in measured["slowest"].items():
+                print(f"{'':>16}{name:<25} {seconds:>8.3f}s")
+            if measured["seconds"] > STARTUP_BUDGET:
+                slow_startup = True
+                print(f"SLOW STARTUP {stage} took {measured['seconds']}s, more than {STARTUP_BUDGET}s")
+    for size in args.sizes:
+        results[str(size)] = run_benchmark(
+            size,
+            track_memory=not args.no_memory,
+            fuzzy=args.fuzzy,
+            rows_per_key=args.rows_per_key,
+            duplicate_rate=args.duplicate_rate,
+            invalid_rate=args.invalid_rate,
+            mismatch_rate=args.mismatch_rate,
+            outlier_rate=args.outlier_rate
+        )
+        for stage, measured in results[str(size)].items():
+            memory = f", peak {measured['peak_mb']}MB" if "peak_mb" in measured else ""
+            print(f"{size:>9} rows  {stage:<25} {measured['seconds']:>8.3f}s{memory}")
+
+    with open(args.output, "w") as f:
+        json.dump({"date": datetime.datetime.now().isoformat(), "results": results}, f, indent=2)
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"])
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions or slow_startup else 0
+
+    return 1 if slow_startup else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
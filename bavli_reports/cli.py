@@ -0,0 +1,149 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from bavli_reports.google_connection import get_connection
+from bavli_reports.local_sheets import LocalClient
+from bavli_reports.report_worker import do_report_work, REPORT_RESULTS
+
+logger = logging.getLogger(__name__)
+
+
+def read_manifest(path: str) -> List[Tuple[str, str]]:
+    """Reads (bavli url, external url) pairs, one pair per line separated by a comma or whitespace"""
+    pairs = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            # urls carry `#gid=...`, so only whole lines can be comments
+            if not line or line.startswith("#"):
+                continue
+            row = [cell for cell in re.split(r"[\s,]+", line) if cell]
+            if len(row) != 2:
+                raise ValueError(f"{path}:{line_number}: expected a bavli url and an external url, got {row}")
+            pairs.append((row[0], row[1]))
+
+    return pairs
+
+
+def run_pair(
+        index: int,
+        bavli_url: str,
+        external_url: str,
+        incremental: bool = False,
+        connection=None,
+        metrics_dir: str = None,
+        bavli_tabs: str = None,
+        external_tabs: str = None,
+        fuzzy: bool = False,
+        rotate: bool = True,
+        processes: int = 1
+) -> bool:
+    def logging_func(msg, level=logging.INFO):
+        logger.log(level, f"[{index}] {msg}")
+
+    start = time.perf_counter()
+    try:
+        summary = do_report_work(
+            bavli_report_url=bavli_url,
+            external_report_url=external_url,
+            logging_func=logging_func,
+            incremental=incremental,
+            connection=connection,
+            bavli_tabs=bavli_tabs,
+            external_tabs=external_tabs,
+            fuzzy=fuzzy,
+            rotate=rotate,
+            processes=processes
+        )
+    except Exception as e:
+        logger.exception(f"[{index}] Oops something went wrong! {e}")
+        print(f"[{index}] FAILED after {time.perf_counter() - start:.1f}s: {bavli_url} <-> {external_url}: {e}")
+        return False
+
+    if metrics_dir:
+        with open(os.path.join(metrics_dir, f"pair_{index}.json"), "w") as f:
+            json.dump({"bavli": bavli_url, "external": external_url, **summary.metrics}, f, indent=2)
+
+    print(
+        f"[{index}] done in {time.perf_counter() - start:.1f}s: "
+        f"{summary.mismatches} mismatches, {summary.outliers} outliers, {summary.invalids} invalids, "
+        f"{summary.matches} matches, {sum(summary.metrics.get('api_calls', {}).values())} API calls "
+        f"({bavli_url} <-> {external_url})"
+    )
+    return True
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Reconcile many bavli/external sheet pairs without the GUI")
+    parser.add_argument("manifest", help="file with one `bavli url,external url` pair per line")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="how many pairs to run at the same time")
+    parser.add_argument("-i", "--incremental", action="store_true", help="only redo what changed since the last run")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the progress of every pair")
+    parser.add_argument(
+        "--offline", metavar="OUTPUT",
+        help="the manifest lists .csv/.xlsx files instead of urls, results are saved under this directory"
+    )
+    parser.add_argument("--bavli-tabs", metavar="PATTERNS", help="reconcile every bavli tab matching these globs")
+    parser.add_argument(
+        "--external-tabs", metavar="PATTERNS", help="reconcile every external tab matching these globs"
+    )
+    parser.add_argument(
+        "--fuzzy", action="store_true",
+        help="normalize keys (e.g. house 12A) and match rows whose names differ by a few typos"
+    )
+    parser.add_argument(
+        "--no-rotate", dest="rotate", action="store_false",
+        help="write over the previous results instead of keeping them in a dated tab"
+    )
+    parser.add_argument(
+        "-p", "--processes", type=int, default=1, help="how many processes match the keys of every pair"
+    )
+    parser.add_argument("--metrics", metavar="DIR", help="save the timings and API usage of every pair as json here")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s",
+        datefmt="%H:%M:%S"
+    )
+
+    pairs = read_manifest(args.manifest)
+    if args.offline:
+        connection = LocalClient()
+    else:
+        # authorize once up front, every worker shares this client and the module wide rate limiter
+        connection = get_connection()
+
+    if args.metrics:
+        os.makedirs(args.metrics, exist_ok=True)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        results = list(pool.map(
+            lambda p: run_pair(
+                p[0], *p[1], incremental=args.incremental, connection=connection, metrics_dir=args.metrics,
+                bavli_tabs=args.bavli_tabs, external_tabs=args.external_tabs, fuzzy=args.fuzzy,
+                rotate=args.rotate, processes=args.processes
+            ),
+            enumerate(pairs, 1)
+        ))
+
+    if args.offline:
+        for spreadsheet in set(connection.spreadsheets.values()):
+            if any(ws.title == REPORT_RESULTS for ws in spreadsheet.worksheets()):
+                spreadsheet.save(os.path.join(args.offline, spreadsheet.title))
+
+    failed = results.count(False)
+    print(f"{len(pairs) - failed}/{len(pairs)} pairs done in {time.perf_counter() - start:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
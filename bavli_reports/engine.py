@@ -0,0 +1,169 @@
+import dataclasses
+import multiprocessing
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Tuple, List, Dict, Callable
+
+from bavli_reports.models import RowDiffs, MatchIndex
+from bavli_reports.normalization import FuzzyMatchIndex
+from bavli_reports.report_state import ReportState, fingerprint
+
+# how many keys are scanned between two progress reports
+PROGRESS_EVERY: int = 1000
+# the key space is split into more shards than there are processes, so one slow shard does not hold up the rest
+SHARDS_PER_PROCESS: int = 4
+
+
+def scan_by_key(key: Tuple, values: List[List], fuzzy: bool = False) -> Tuple[Dict, List[RowDiffs]]:
+    """With `fuzzy`, match values are compared normalized and rows left unmatched are paired with the closest
+    remaining row by edit distance"""
+    bavli = values[0]
+    external = values[1]
+
+    matches: List[RowDiffs] = []
+    mismatch_bavli = []
+    external_index = FuzzyMatchIndex(external) if fuzzy else MatchIndex(external)
+
+    for row in bavli:
+        matched_external_row = external_index.pop_match(row)
+        if matched_external_row:
+            matches.append(RowDiffs(row, matched_external_row))
+        else:
+            mismatch_bavli.append(row)
+
+    if fuzzy and mismatch_bavli:
+        # only once every exact match is taken, so a close match never steals a row that had an exact one
+        unmatched, mismatch_bavli = mismatch_bavli, []
+        for row in unmatched:
+            matched_external_row = external_index.pop_closest(row)
+            if matched_external_row:
+                matches.append(RowDiffs(row, matched_external_row))
+            else:
+                mismatch_bavli.append(row)
+    mismatch_external = external_index.remaining()
+
+    mismatches = {("bavli", *key): mismatch_bavli} if mismatch_bavli else {}
+    mismatches.update({("external", *key): mismatch_external} if mismatch_external else {})
+
+    return mismatches, matches
+
+
+@dataclasses.dataclass
+class Reconciliation:
+    """What matching the bavli rows against the external rows came up with
+
+    `state` holds the scan of every key found in both, for the next incremental run.
+    """
+    # those which are present in one sheet but not the other
+    outliers: Dict[Tuple, List] = dataclasses.field(default_factory=dict)
+    # those which are present on both but value is a mismatch
+    mismatches: Dict[Tuple, List] = dataclasses.field(default_factory=dict)
+    keyed_matches: List[Tuple[Tuple, RowDiffs]] = dataclasses.field(default_factory=list)
+    intersection: int = 0
+    rescanned: int = 0
+    state: ReportState = dataclasses.field(default_factory=ReportState)
+
+    def update(self, other: "Reconciliation"):
+        self.outliers.update(other.outliers)
+        self.mismatches.update(other.mismatches)
+        self.keyed_matches.extend(other.keyed_matches)
+        self.intersection += other.intersection
+        self.rescanned += other.rescanned
+        self.state.scans.update(other.state.scans)
+
+
+def reconcile(
+        bavli_values: Dict[Tuple, List],
+        external_values: Dict[Tuple, List],
+        fuzzy: bool = False,
+        previous_state: ReportState = None,
+        progress: Callable[[int, int], None] = None,
+        keep_state: bool = False
+) -> Reconciliation:
+    """Finds the outliers and scans every key found in both, keys whose rows did not change since
+    `previous_state` are not scanned again
+
+    Only with `keep_state` (or a `previous_state`) are the scans fingerprinted and kept in `state`, a plain run
+    does not pay for the next incremental one.
+    """
+    result = Reconciliation()
+    result.outliers = {
+        **{("bavli", *k): v for k, v in bavli_values.items() if k not in external_values},
+        **{("external", *k): v for k, v in external_values.items() if k not in bavli_values},
+    }
+
+    intersection = [k for k in bavli_values.keys() if k in external_values]
+    result.intersection = len(intersection)
+    keep_state = keep_state or previous_state is not None
+    for i, k in enumerate(intersection):
+        if progress and i % PROGRESS_EVERY == 0:
+            progress(i, len(intersection))
+        v = [bavli_values[k], external_values[k]]
+        if not keep_state:
+            misses, matches = scan_by_key(k, v, fuzzy)
+            result.rescanned += 1
+            result.mismatches.update(misses)
+            result.keyed_matches.extend((k, m) for m in matches)
+            continue
+
+        # a fuzzy scan of the same rows has a different outcome, never reuse one for the other
+        key_fingerprint = fingerprint([v, "fuzzy"] if fuzzy else v)
+        scanned = previous_state and previous_state.get_scan(k, key_fingerprint)
+        if not scanned:
+            scanned = scan_by_key(k, v, fuzzy)
+            result.rescanned += 1
+        misses, matches = scanned
+        result.state.set_scan(k, key_fingerprint, misses, matches)
+        result.mismatches.update(misses)
+        result.keyed_matches.extend((k, m) for m in matches)
+
+    return result
+
+
+def shard_of(key: Tuple, shards: int) -> int:
+    # unlike `hash`, the same in every process and every run
+    return zlib.crc32("\x1f".join(key).encode("utf-8")) % shards
+
+
+def reconcile_sharded(
+        bavli_values: Dict[Tuple, List],
+        external_values: Dict[Tuple, List],
+        processes: int,
+        fuzzy: bool = False,
+        previous_state: ReportState = None,
+        progress: Callable[[int, int], None] = None,
+        keep_state: bool = False
+) -> Reconciliation:
+    """`reconcile` with the (house, zip) key space hash-partitioned over a pool of `processes` processes
+
+    Every key lands in exactly one shard along with all of its rows from both sheets, so the shards are reconciled
+    independently and merged back in shard order, the same way on every run.
+    """
+    shards = processes * SHARDS_PER_PROCESS
+    parts: List[Tuple[Dict, Dict]] = [({}, {}) for _ in range(shards)]
+    for side, values in enumerate((bavli_values, external_values)):
+        for k, v in values.items():
+            parts[shard_of(k, shards)][side][k] = v
+
+    # forking a process that runs other threads (the GUI, the rate limiter) can leave it holding their locks
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(
+                reconcile, bavli, external, fuzzy,
+                previous_state and previous_state.subset(bavli.keys() & external.keys()), None, keep_state
+            )
+            for bavli, external in parts
+        ]
+        try:
+            for done, _ in enumerate(as_completed(futures), 1):
+                if progress:
+                    progress(done, shards)
+        except BaseException:
+            # e.g. a cancelled run, shards that did not start yet never will
+            pool.shutdown(cancel_futures=True)
+            raise
+
+    result = Reconciliation()
+    for future in futures:
+        result.update(future.result())
+    return result
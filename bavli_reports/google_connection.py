@@ -1,184 +1,671 @@
+import json
 import os.path
 
-import requests
-import json
 import string
-from collections import defaultdict
+from datetime import datetime
+import sys
+import threading
+from fnmatch import fnmatchcase
+from collections import defaultdict, deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from logging import getLogger
 
 import gspread as gs
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
 
-from typing import List, Tuple, Dict, Callable
+from typing import List, Tuple, Dict, Callable, Iterable, Iterator, Optional
 
 from gspread import Spreadsheet, Worksheet, Client
 from gspread.auth import store_credentials
+from gspread.exceptions import NoValidUrlKeyFound, WorksheetNotFound
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from gspread.utils import absolute_range_name, extract_id_from_url
 
 from bavli_reports import ROOT_DIR
-from bavli_reports.models import BackgroundColor, Format, Range, WriteRequests, FormatRequest, format_cells
+from bavli_reports.models import BackgroundColor, Format, Range, RateLimiter, FormatRequest, format_cells, \
+    split_by_size, PrefetchedReport, MAX_BATCH_BYTES
+from bavli_reports.metrics import in_context, count_response_bytes
+from bavli_reports.sheet_cache import SheetCache
+from bavli_reports.validation import get_validator, format_errors
 
 logger = getLogger(__name__)
 
 
 DELIMITER: str = "~~~"
+# how many rows are pulled from a worksheet in a single request
+CHUNK_SIZE: int = 5000
 CREDENTIALS = os.path.join(ROOT_DIR, "credentials.json")
 AUTHORIZATION = os.path.join(ROOT_DIR, "authorized_user.json")
 
-write_requests = WriteRequests()
-
-
-def refresh_token(authorized_user_filename: str):
-    os.remove(AUTHORIZATION)
-    # with open(authorized_user_filename, "r") as f:
-    #     creds = json.load(f)
-    #     params = {
-    #         "grant_type": "refresh_token",
-    #         "client_id": creds["client_id"],
-    #         "client_secret": creds["client_secret"],
-    #         "refresh_token": creds["refresh_token"]
-    #     }
-    #
-    #     authorization_url = "https://www.googleapis.com/oauth2/v4/token"
-    #
-    #     r = requests.post(authorization_url, data=params)
-    #
-    #     if r.ok:
-    #         return {
-    #             **creds,
-    #             "token": r.json()["access_token"]
-    #         }
-    #     else:
-    #         return creds
-
-
-def get_connection():
-    gc: Client = gs.oauth(credentials_filename=CREDENTIALS, authorized_user_filename=AUTHORIZATION)
-    if gc.auth.expired:
-        creds = refresh_token(authorized_user_filename=AUTHORIZATION)
-        gc = gs.oauth(credentials_filename=CREDENTIALS, authorized_user_filename=AUTHORIZATION)
-
-    return gc
+rate_limiter = RateLimiter()
+sheet_cache = SheetCache()
+
+
+# one authorized client per credentials file, shared by every report run in this process
+_connections: Dict[str, Client] = {}
+_connections_lock = threading.Lock()
+# plain (unauthorized) transport for token refreshes, kept around so its HTTP session is reused
+_auth_request = Request()
+
+
+def refresh_token(gc: Client, authorized_user_filename: str = AUTHORIZATION) -> bool:
+    try:
+        gc.auth.refresh(_auth_request)
+    except RefreshError as e:
+        logger.warning(f"Could not refresh the access token: {e}")
+        return False
+
+    store_credentials(gc.auth, filename=authorized_user_filename)
+    return True
+
+
+def get_connection(credentials_filename: str = CREDENTIALS, authorized_user_filename: str = AUTHORIZATION) -> Client:
+    with _connections_lock:
+        gc: Client = _connections.get(credentials_filename)
+        if gc is None:
+            gc = gs.oauth(credentials_filename=credentials_filename, authorized_user_filename=authorized_user_filename)
+
+        if not gc.auth.valid and not refresh_token(gc, authorized_user_filename):
+            # the refresh token itself is no good anymore, go through the whole authorization flow again
+            if os.path.exists(authorized_user_filename):
+                os.remove(authorized_user_filename)
+            gc = gs.oauth(credentials_filename=credentials_filename, authorized_user_filename=authorized_user_filename)
+
+        if count_response_bytes not in gc.session.hooks["response"]:
+            gc.session.hooks["response"].append(count_response_bytes)
+        _connections[credentials_filename] = gc
+        return gc
 
 
 def get_report_by_url(url: str, connection: Client = None) -> Spreadsheet:
     if not connection:
         connection = get_connection()
-    return connection.open_by_url(url)
-
-
-def _cleanup_values(values: List[List], filter_by: Callable[[List], bool] = None) -> tuple[list[list], list[list]]:
-    def default_filter(row_check: List) -> bool:
-        house, zip_code = row_check[1:3]
-        if house or zip_code:
-            try:
-                int(house)
-                int(zip_code)
-            except ValueError:
-                return False
-            else:
-                return True
-        raise ValueError(f"invalid row -> both identifiers are empty: ({house}, {zip_code})")
+    try:
+        spreadsheet_id = extract_id_from_url(url)
+    except NoValidUrlKeyFound:
+        spreadsheet_id = url
+    return rate_limiter.read(connection.open_by_url, url, spreadsheet_id=spreadsheet_id)
+
+
+def prefetch_report(url: str, connection: Client = None) -> PrefetchedReport:
+    spreadsheet = get_report_by_url(url, connection=connection)
+    return PrefetchedReport(spreadsheet, rate_limiter.read(spreadsheet.worksheets, spreadsheet_id=spreadsheet.id))
 
+
+def get_worksheet(spreadsheet: Spreadsheet, index: int = 0) -> Worksheet:
+    return rate_limiter.read(spreadsheet.get_worksheet, index, spreadsheet_id=spreadsheet.id)
+
+
+def find_worksheet(spreadsheet: Spreadsheet, title: str) -> Worksheet:
+    return rate_limiter.read(spreadsheet.worksheet, title, spreadsheet_id=spreadsheet.id)
+
+
+def _iter_cleanup(
+        values: Iterable[List],
+        filter_by: Callable[[List], bool] = None,
+        errors: Counter = None
+) -> Iterator[Tuple[bool, List]]:
+    """Without `filter_by` rows are checked against the validation rules (see `get_validator`), and what was wrong
+    with them is added up in `errors`"""
     if not filter_by:
-        filter_by = default_filter
+        yield from get_validator().iter_validate(values, Counter() if errors is None else errors)
+        return
 
-    valid_values = []
-    invalid_values = []
     for row in values:
         try:
-            valid_values.append(row) if filter_by(row) else invalid_values.append(row)
+            yield filter_by(row), row
         except ValueError as e:
             logger.error(e)
             continue
 
+
+def _log_errors(name: str, errors: Counter):
+    message = format_errors(errors)
+    if message:
+        logger.warning(f"{name}: {message}")
+
+
+def _cleanup_values(values: Iterable[List], filter_by: Callable[[List], bool] = None) -> tuple[list[list], list[list]]:
+    valid_values = []
+    invalid_values = []
+    for is_valid, row in _iter_cleanup(values, filter_by):
+        valid_values.append(row) if is_valid else invalid_values.append(row)
+
     return valid_values, invalid_values
 
 
-def _transform_values(values: List[List], name: str) -> Dict[Tuple, List]:
+def _add_row(to_return: Dict[Tuple, List], row: List):
+    # the same few values (streets, cities, statuses) repeat all over a report, intern them and keep immutable tuples
+    tup = tuple(map(sys.intern, row[1:3]))
+    to_return[tup].append(tuple(map(sys.intern, islice(row, 3, None))))
+
+
+def _transform_values(values: Iterable[List], name: str) -> Dict[Tuple, List]:
     to_return: Dict[Tuple, List] = defaultdict(list)
     for row in values:
-        tup = tuple(row[1:3])
-        to_return[tup].append(row[3:])
+        _add_row(to_return, row)
 
     return to_return
 
 
-def extract_values(sheet: Worksheet, name: str = None) -> tuple[dict[tuple, list], dict[tuple, list]]:
-    values: List[List] = sheet.get_values()[1:-2]
-    valid_values, invalid_values = _cleanup_values(values)
-    return _transform_values(valid_values, name), _transform_values(invalid_values, name)
+def _trim(values: Iterable[List], head: int = 1, tail: int = 2) -> Iterator[List]:
+    """Streaming version of `values[head:-tail]`"""
+    held_back = deque()
+    for row in islice(values, head, None):
+        held_back.append(row)
+        if len(held_back) > tail:
+            yield held_back.popleft()
+
+
+def get_revision(spreadsheet: Spreadsheet) -> str:
+    metadata = rate_limiter.read(
+        spreadsheet.client.request, "get", f"{DRIVE_FILES_API_V3_URL}/{spreadsheet.id}",
+        params={"fields": "version,modifiedTime", "supportsAllDrives": True},
+        spreadsheet_id=spreadsheet.id
+    ).json()
+    return f"{metadata['version']}:{metadata['modifiedTime']}"
+
+
+def cached_revision(spreadsheet: Spreadsheet) -> Optional[str]:
+    """The current revision of a spreadsheet we have cached worksheets of, None when we have not"""
+    return get_revision(spreadsheet) if sheet_cache.seen(spreadsheet.id) else None
+
+
+def _fetch_chunks(sheet: Worksheet, chunk_size: int) -> Iterator[List[List]]:
+    spreadsheet = sheet.spreadsheet
+
+    def fetch(start: int) -> List[List]:
+        rows_range = absolute_range_name(sheet.title, f"{start}:{start + chunk_size - 1}")
+        return rate_limiter.read(spreadsheet.values_get, rows_range, spreadsheet_id=spreadsheet.id).get("values", [])
+
+    # the next chunk is downloaded while the current one is being processed
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        fetch = in_context(fetch)
+        next_chunk = pool.submit(fetch, 1)
+        for start in range(1, sheet.row_count + 1, chunk_size):
+            chunk = next_chunk.result()
+            if start + chunk_size <= sheet.row_count:
+                next_chunk = pool.submit(fetch, start + chunk_size)
+            yield chunk
+
+
+def iter_sheet_rows(sheet: Worksheet, chunk_size: int = CHUNK_SIZE) -> Iterator[List]:
+    """Streams the worksheet rows `chunk_size` rows at a time, shaped like `get_values` would have returned them"""
+    width = 0
+    # the API leaves out empty rows at the end of a range, they only count if something comes after them
+    missing_rows = 0
+    for chunk in _fetch_chunks(sheet, chunk_size):
+        if chunk:
+            for _ in range(missing_rows):
+                yield [""] * width
+            missing_rows = 0
+
+        for row in chunk:
+            width = max(width, len(row))
+            yield row + [""] * (width - len(row))
+        missing_rows += chunk_size - len(chunk)
+
+
+def get_sheet_values(sheet: Worksheet, use_cache: bool = True, chunk_size: int = CHUNK_SIZE) -> Iterator[List]:
+    spreadsheet = sheet.spreadsheet
+    if not use_cache or getattr(spreadsheet, "offline", False):
+        return iter_sheet_rows(sheet, chunk_size)
+
+    revision = get_revision(spreadsheet)
+    values = sheet_cache.get(spreadsheet.id, sheet.id, revision)
+    if values is None:
+        values = sheet_cache.put(spreadsheet.id, sheet.id, revision, iter_sheet_rows(sheet, chunk_size))
+    else:
+        logger.info(f"{sheet.title} did not change since the last run, using the cached values")
+
+    return values
+
+
+def extract_values(
+        sheet: Worksheet,
+        name: str = None,
+        use_cache: bool = True,
+        chunk_size: int = CHUNK_SIZE
+) -> tuple[dict[tuple, list], dict[tuple, list]]:
+    valid_values: Dict[Tuple, List] = defaultdict(list)
+    invalid_values: Dict[Tuple, List] = defaultdict(list)
+    errors = Counter()
+    for is_valid, row in _iter_cleanup(_trim(get_sheet_values(sheet, use_cache, chunk_size)), errors=errors):
+        _add_row(valid_values if is_valid else invalid_values, row)
+    _log_errors(name or sheet.title, errors)
+
+    return valid_values, invalid_values
+
+
+def select_worksheets(
+        spreadsheet: Spreadsheet,
+        patterns: str,
+        exclude: Iterable[str] = ()
+) -> List[Worksheet]:
+    """Every worksheet whose title matches one of the comma separated glob `patterns` (e.g. `2023-*,Summary`)
+    and none of the `exclude` globs, in the spreadsheet's order"""
+    globs = [pattern.strip() for pattern in patterns.split(",") if pattern.strip()]
+    worksheets = rate_limiter.read(spreadsheet.worksheets, spreadsheet_id=spreadsheet.id)
+    selected = [
+        ws for ws in worksheets
+        if not any(fnmatchcase(ws.title, glob) for glob in exclude) and any(fnmatchcase(ws.title, glob) for glob in globs)
+    ]
+    if not selected:
+        raise WorksheetNotFound(f"no worksheet in {spreadsheet.title} matches {patterns}")
+    return selected
+
+
+def _pad_rows(rows: Iterable[List]) -> Iterator[List]:
+    width = 0
+    for row in rows:
+        width = max(width, len(row))
+        yield row + [""] * (width - len(row))
+
+
+def get_worksheets_values(worksheets: List[Worksheet], use_cache: bool = True) -> List[Iterable[List]]:
+    """The values of several worksheets of the same spreadsheet, every one that is not cached is pulled in a
+    single `values_batch_get`"""
+    spreadsheet = worksheets[0].spreadsheet
+    use_cache = use_cache and not getattr(spreadsheet, "offline", False)
+    revision = use_cache and get_revision(spreadsheet)
+
+    values: List[Iterable[List]] = [use_cache and sheet_cache.get(spreadsheet.id, ws.id, revision) for ws in worksheets]
+    missing = [i for i, cached in enumerate(values) if not cached]
+    if missing:
+        response = rate_limiter.read(
+            spreadsheet.values_batch_get, [absolute_range_name(worksheets[i].title) for i in missing],
+            spreadsheet_id=spreadsheet.id
+        )
+        for i, value_range in zip(missing, response.get("valueRanges", [])):
+            values[i] = _pad_rows(value_range.get("values", []))
+            if use_cache:
+                values[i] = sheet_cache.put(spreadsheet.id, worksheets[i].id, revision, values[i])
+
+    return values
+
+
+def extract_worksheets_values(
+        worksheets: List[Worksheet],
+        name: str = None,
+        use_cache: bool = True
+) -> tuple[dict[tuple, list], dict[tuple, list]]:
+    """Same as `extract_values`, with the rows of all `worksheets` merged into one index"""
+    valid_values: Dict[Tuple, List] = defaultdict(list)
+    invalid_values: Dict[Tuple, List] = defaultdict(list)
+    errors = Counter()
+    for values in get_worksheets_values(worksheets, use_cache):
+        # every tab comes with its own header and summary rows
+        for is_valid, row in _iter_cleanup(_trim(values), errors=errors):
+            _add_row(valid_values if is_valid else invalid_values, row)
+    _log_errors(name or worksheets[0].spreadsheet.title, errors)
+
+    return valid_values, invalid_values
 
 
 def _get_next_row(sheet: Worksheet) -> int:
-    cells = sheet.findall(DELIMITER)
+    cells = rate_limiter.read(sheet.findall, DELIMITER, spreadsheet_id=sheet.spreadsheet.id)
     return (cells and cells[-1].row or 0) + 1
 
 
-def write_legend(sheet: Worksheet):
-    global write_requests
-    values = [[
-        "Found Match",
-        "Diffs in matched rows",
-        "In One but not the Other",
-        "Invalids",
-        "No match"
-    ]]
-    formats = [
-        BackgroundColor.LIGHT_GREEN,
-        BackgroundColor.YELLOW,
-        BackgroundColor.ORANGE,
-        BackgroundColor.PURPLE,
-        BackgroundColor.RED
-    ]
+# the title an older results worksheet is renamed to (see `provision_worksheet`), formatted with `datetime.strftime`,
+# without a ':' since worksheets are also saved as files named after their title (see `LocalSpreadsheet.save`)
+ROTATED_TITLE: str = "{title} %Y-%m-%d %H-%M-%S"
 
-    vrange = Range.from_first_and_values(values)
+LEGEND: List[Tuple[str, BackgroundColor]] = [
+    ("Found Match", BackgroundColor.LIGHT_GREEN),
+    ("Diffs in matched rows", BackgroundColor.YELLOW),
+    ("In One but not the Other", BackgroundColor.ORANGE),
+    ("Invalids", BackgroundColor.PURPLE),
+    ("No match", BackgroundColor.RED),
+]
 
-    write_requests += 1
-    sheet.update(*_add_separator(vrange, values))
 
-    format_request = FormatRequest()
-    for i, f in enumerate(formats):
-        frange = f"{string.ascii_uppercase[i]}1:{string.ascii_uppercase[i]}1"
+# the legend and its separator take the first two rows of a report
+LEGEND_ROWS: int = 2
 
-        format_request.add_request(format_cells(frange, f.value, sheet.id))
 
-    write_requests += 1
-    sheet.spreadsheet.batch_update(format_request.request)
+def report_size(sections: List[Tuple[int, int]]) -> Tuple[int, int]:
+    """The rows (a separator after every section, legend not included) and columns that sections of the given
+    (rows, columns) take"""
+    rows = sum(section_rows + 1 for section_rows, _ in sections)
+    columns = max(len(LEGEND), max((section_columns for _, section_columns in sections), default=0))
+    return rows, columns
 
 
 def _add_separator(values_range: Range, values: List[List]):
     values_range.second_row += 1
-    return values_range, values + [["~~~"]]
+    return values_range, values + [[DELIMITER]]
+
+
+# what a row that no longer needs a color is painted with when patching
+CLEAR_FORMAT = {"backgroundColor": {"red": 1.0, "green": 1.0, "blue": 1.0}}
+
+
+class ReportWriter:
+    """Collects all the report sections and sends them to the sheet in one go
+
+    Row offsets are computed locally, so writing the legend and every section costs a single
+    `values_batch_update` and a single `batch_update` no matter how many sections there are.
+
+    With `keep_rows`, every section row is also kept (with its color name and colored cells) in `rows`. When
+    `previous` holds the rows of an earlier report written at `start_row`, the writer patches that report in place
+    and only sends the rows that changed.
+
+    Very large reports do not have to wait for `flush`, `send_full_batches` sends what makes up a full batch as soon
+    as it is there.
+    """
+
+    def __init__(
+            self,
+            sheet: Worksheet,
+            start_row: int = None,
+            previous: List[List] = None,
+            keep_rows: bool = False,
+            base_revision: str = None,
+            max_bytes: int = MAX_BATCH_BYTES
+    ):
+        """`base_revision` is the spreadsheet's revision (see `cached_revision`) from before anything was written to
+        it, when the sheet was already written to (e.g. provisioned) before the writer existed. No request sent is
+        bigger than `max_bytes`, a section too big for one is split into ranges of consecutive rows."""
+        self.sheet = sheet
+        self.next_row = start_row or _get_next_row(sheet)
+        self.previous = previous
+        self.base_revision = base_revision
+        self.max_bytes = max_bytes
+        self._sent = False
+        # patching compares against the rows written now
+        self.keep_rows = keep_rows or previous is not None
+        self.first_row: int = None
+        self.rows: List[List] = []
+        self._data: List[Dict] = []
+        # roughly how big the values waiting in `_data` are once sent
+        self._data_bytes = 0
+        self._format_request = FormatRequest()
+
+    def _add_range(self, values_range: Range, values: List[List]):
+        """Adds `values` as one or more ranges of consecutive rows, each small enough for a batch of its own"""
+        def chunk_range(first: int, last: int) -> str:
+            return absolute_range_name(self.sheet.title, str(Range(
+                values_range.first_column, values_range.first_row + first,
+                values_range.second_column, values_range.first_row + last - 1
+            )))
+
+        # sized as `split_by_size` measures it, with the longest range name any chunk can have
+        envelope = len(json.dumps({"range": chunk_range(len(values) - 1, len(values)), "values": []}, ensure_ascii=False))
+        start, size = 0, envelope
+        for end, row in enumerate(values):
+            row_size = len(json.dumps(row, ensure_ascii=False)) + 2
+            if end > start and size + row_size > self.max_bytes:
+                self._data.append({"range": chunk_range(start, end), "values": values[start:end]})
+                self._data_bytes += size
+                start, size = end, envelope
+            size += row_size
+
+        self._data.append({"range": chunk_range(start, len(values)), "values": values[start:]})
+        self._data_bytes += size
+
+    def add_legend(self):
+        values = [[title for title, _ in LEGEND]]
+        self._add_range(*_add_separator(Range.from_first_and_values(values), values))
+
+        for i, (_, f) in enumerate(LEGEND):
+            frange = f"{string.ascii_uppercase[i]}1:{string.ascii_uppercase[i]}1"
+            self._format_request.add_request(format_cells(frange, f.value, self.sheet.id))
+
+        self.next_row = max(self.next_row, LEGEND_ROWS + 1)
+
+    def _format_row_cells(self, sheet_row: int, cells: List[List]):
+        """Colors single cells of a row, neighbouring cells of the same color share one request"""
+        start = 0
+        for end in range(1, len(cells) + 1):
+            if end < len(cells) and cells[end] == [cells[end - 1][0] + 1, cells[start][1]]:
+                continue
+
+            frange = Range(
+                Range.int_to_column(cells[start][0]), sheet_row, Range.int_to_column(cells[end - 1][0]), sheet_row
+            )
+            self._format_request.add_request(
+                format_cells(str(frange), BackgroundColor[cells[start][1]].value, self.sheet.id)
+            )
+            start = end
+
+    def add_values(
+            self,
+            values: List[List[str]],
+            formatting: List[Tuple[Range, BackgroundColor]] = None,
+            cell_colors: List[Tuple[int, int, BackgroundColor]] = None
+    ):
+        """`cell_colors` are (row, column, color) of single cells to color on top of `formatting`, both 1-based"""
+        start_row = self.next_row
+        if self.first_row is None:
+            self.first_row = start_row
+
+        cells: List[List[List]] = [[] for _ in values]
+        for row, column, f in sorted(cell_colors or [], key=lambda c: c[:2]):
+            cells[row - 1].append([column, f.name])
+
+        offset = len(self.rows)
+        if self.keep_rows:
+            colors = [BackgroundColor.WHITE.name] * len(values)
+            for r, f in formatting or []:
+                colors[r.first_row - 1:r.second_row] = [f.name] * (r.second_row - r.first_row + 1)
+            self.rows.extend([row, color, row_cells] for row, color, row_cells in zip(values, colors, cells))
+            self.rows.append([[DELIMITER], BackgroundColor.WHITE.name, []])
+        self.next_row = start_row + len(values) + 1
+
+        if self.previous is not None:
+            self._patch_rows([
+                i for i in range(offset, len(self.rows))
+                if i >= len(self.previous) or self.previous[i] != self.rows[i]
+            ])
+            return
+
+        values_range = Range.from_first_and_values(values or [[DELIMITER]], "A", start_row)
+        if not values:
+            values_range.second_row -= 1
+
+        ranges, final_values = _add_separator(values_range, values)
+        self._add_range(ranges, final_values)
+
+        self._add_section_formats(formatting or [], start_row)
+
+        for i, row_cells in enumerate(cells):
+            if row_cells:
+                self._format_row_cells(start_row + i, row_cells)
+
+    def _add_section_formats(self, formatting: List[Tuple[Range, BackgroundColor]], start_row: int):
+        for r, _ in formatting:
+            r.add_to_rows(start_row - 1)
+
+        # when every row of the section is colored, paint all of it with its most common color in one go
+        # and only paint the other groups on top of it
+        base_color = None
+        if len(formatting) > 1 and all(f != BackgroundColor.WHITE for _, f in formatting):
+            base_color = Counter(f for _, f in formatting).most_common(1)[0][0]
+            whole_section = Range(
+                "A", formatting[0][0].first_row,
+                Range.int_to_column(max(Range.column_to_int(r.second_column) for r, _ in formatting)),
+                formatting[-1][0].second_row
+            )
+            self._format_request.add_request(format_cells(str(whole_section), base_color.value, self.sheet.id))
+
+        for r, f in formatting:
+            if f in (BackgroundColor.WHITE, base_color):
+                continue
+
+            self._format_request.add_request(format_cells(str(r), f.value, self.sheet.id))
+
+    def _patched_row(self, i: int) -> List:
+        row, color, cells = self.rows[i] if i < len(self.rows) else [[], BackgroundColor.WHITE.name, []]
+        # pad with blanks so nothing from the previous row is left behind
+        width = len(self.previous[i][0]) if i < len(self.previous) else 0
+        return [row + [""] * (width - len(row)), color, cells]
+
+    def _patch_rows(self, indexes: List[int]):
+        runs: List[List[int]] = []
+        for i in indexes:
+            if runs and runs[-1][-1] == i - 1:
+                runs[-1].append(i)
+            else:
+                runs.append([i])
+
+        for run in runs:
+            patched = [self._patched_row(i) for i in run]
+            last_column = Range.int_to_column(max(len(row) for row, _, _ in patched) or 1)
+            first_row = self.first_row + run[0]
+            self._add_range(
+                Range("A", first_row, last_column, first_row + len(run) - 1),
+                [row for row, _, _ in patched]
+            )
+
+            start = 0
+            for end in range(1, len(patched) + 1):
+                if end < len(patched) and patched[end][1] == patched[start][1]:
+                    continue
+
+                color = BackgroundColor[patched[start][1]]
+                frange = Range("A", first_row + start, last_column, first_row + end - 1)
+                cell_format = CLEAR_FORMAT if color == BackgroundColor.WHITE else color.value
+                self._format_request.add_request(format_cells(str(frange), cell_format, self.sheet.id))
+                start = end
+
+            for i, (_, _, cells) in enumerate(patched):
+                if cells:
+                    self._format_row_cells(first_row + i, cells)
+
+    def send_full_batches(self):
+        """Sends everything added so far once the values make up at least a whole batch"""
+        if self._data_bytes >= self.max_bytes:
+            self._send()
+
+    def flush(self, progress: Callable[[int, int], None] = None):
+        """`progress(done, total)` is called after every request sent"""
+        spreadsheet = self.sheet.spreadsheet
+
+        # the previous report was longer, blank out whatever is left of it
+        if self.previous is not None and len(self.previous) > len(self.rows):
+            self._patch_rows(list(range(len(self.rows), len(self.previous))))
+            self.previous = list(self.rows)
+
+        self._send(progress)
+
+        # our own writes bump the revision, keep the cached source worksheets valid (unless someone else edited)
+        if sheet_cache.seen(spreadsheet.id):
+            sheet_cache.restamp(spreadsheet.id, get_revision(spreadsheet), self.base_revision)
+
+    def _send(self, progress: Callable[[int, int], None] = None):
+        spreadsheet = self.sheet.spreadsheet
+        if not self._sent:
+            self._sent = True
+            self.base_revision = self.base_revision or cached_revision(spreadsheet)
+
+        # normally a single request each, very large reports are split into size-bounded batches
+        values_batches = list(split_by_size(self._data, self.max_bytes))
+        format_batches = list(self._format_request.batches())
+        total = len(values_batches) + len(format_batches)
+        for done, data in enumerate(values_batches, 1):
+            rate_limiter.write(
+                spreadsheet.values_batch_update, body={"valueInputOption": "RAW", "data": data},
+                spreadsheet_id=spreadsheet.id
+            )
+            progress and progress(done, total)
+        self._data = []
+        self._data_bytes = 0
+
+        for done, body in enumerate(format_batches, len(values_batches) + 1):
+            rate_limiter.write(spreadsheet.batch_update, body, spreadsheet_id=spreadsheet.id)
+            progress and progress(done, total)
+        self._format_request = FormatRequest()
+
+
+def write_legend(sheet: Worksheet):
+    writer = ReportWriter(sheet, start_row=1)
+    writer.add_legend()
+    writer.flush()
 
 
 def write_values(sheet: Worksheet, values: List[List[str]], formatting: List[Tuple[Range, BackgroundColor]] = None):
-    global write_requests
+    writer = ReportWriter(sheet)
+    writer.add_values(values, formatting)
+    writer.flush()
+
+
+def create_worksheet(
+        spreadsheet: Spreadsheet,
+        name: str = "Report results",
+        rows: int = 100,
+        cols: int = 26
+) -> Worksheet:
+    return rate_limiter.write(spreadsheet.add_worksheet, title=name, rows=rows, cols=cols, spreadsheet_id=spreadsheet.id)
 
-    start_row = _get_next_row(sheet)
-    values_range = Range.from_first_and_values(values, "A", start_row)
 
-    ranges, final_values = _add_separator(values_range, values)
+def _worksheet_from_properties(spreadsheet: Spreadsheet, properties: dict) -> Worksheet:
+    if getattr(spreadsheet, "offline", False):
+        # an in memory lookup, not an API call
+        return spreadsheet.worksheet(properties["title"])
+    return Worksheet(spreadsheet, properties)
 
-    write_requests += 1
-    sheet.update(str(ranges), final_values)
 
-    format_request = FormatRequest()
-    for r, f in formatting or []:
-        if f == BackgroundColor.WHITE:
-            continue
+def _grid_properties_request(sheet_id: int, rows: int, cols: int) -> dict:
+    return {"updateSheetProperties": {
+        "properties": {"sheetId": sheet_id, "gridProperties": {"rowCount": rows, "columnCount": cols}},
+        "fields": "gridProperties(rowCount,columnCount)",
+    }}
 
-        r.add_to_rows(start_row - 1)
-        format_request.add_request(format_cells(str(r), f.value, sheet.id))
 
-    write_requests += 1
-    sheet.spreadsheet.batch_update(format_request.request)
+def _rotated_title(spreadsheet: Spreadsheet, title: str) -> str:
+    """The dated title (see `ROTATED_TITLE`) to rename `title` to, with a counter when two runs rotated within the
+    same second"""
+    rotated_title = datetime.now().strftime(ROTATED_TITLE.format(title=title))
+    # titles are unique regardless of case
+    taken = {ws.title.casefold() for ws in rate_limiter.read(spreadsheet.worksheets, spreadsheet_id=spreadsheet.id)}
+    candidate, counter = rotated_title, 1
+    while candidate.casefold() in taken:
+        counter += 1
+        candidate = f"{rotated_title} ({counter})"
+    return candidate
 
 
-def create_worksheet(
+def provision_worksheet(
         spreadsheet: Spreadsheet,
-        name: str = "Report results",
-        rows: int = 100,
-        cols: int = 26
+        title: str,
+        rows: int,
+        cols: int,
+        existing: Worksheet = None,
+        rotate: bool = True
 ) -> Worksheet:
-    global write_requests
-    write_requests += 1
-    return spreadsheet.add_worksheet(title=name, rows=rows, cols=cols)
+    """A blank `rows` x `cols` worksheet named `title`, set up with a single `batch_update`
+
+    The `existing` worksheet by that name is either renamed to a dated tab (see `ROTATED_TITLE`) to keep the
+    previous results around (`rotate`), or resized and cleared to be written over.
+    """
+    if existing is not None and not rotate:
+        rate_limiter.write(spreadsheet.batch_update, {"requests": [
+            _grid_properties_request(existing.id, rows, cols),
+            {"updateCells": {"range": {"sheetId": existing.id}, "fields": "userEnteredValue,userEnteredFormat"}},
+        ]}, spreadsheet_id=spreadsheet.id)
+        return existing
+
+    requests = []
+    if existing is not None:
+        requests.append({"updateSheetProperties": {
+            "properties": {"sheetId": existing.id, "title": _rotated_title(spreadsheet, title)}, "fields": "title"
+        }})
+    requests.append({"addSheet": {"properties": {
+        "title": title, "sheetType": "GRID", "gridProperties": {"rowCount": rows, "columnCount": cols}
+    }}})
+    response = rate_limiter.write(spreadsheet.batch_update, {"requests": requests}, spreadsheet_id=spreadsheet.id)
+    return _worksheet_from_properties(spreadsheet, response["replies"][-1]["addSheet"]["properties"])
+
+
+def fit_worksheet(sheet: Worksheet, rows: int, cols: int):
+    """Grows `sheet` to at least `rows` x `cols` in one request, unless it is that big already"""
+    if sheet.row_count >= rows and sheet.col_count >= cols:
+        return
+
+    spreadsheet = sheet.spreadsheet
+    rate_limiter.write(spreadsheet.batch_update, {"requests": [
+        _grid_properties_request(sheet.id, max(rows, sheet.row_count), max(cols, sheet.col_count))
+    ]}, spreadsheet_id=spreadsheet.id)
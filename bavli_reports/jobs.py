@@ -0,0 +1,115 @@
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from logging import getLogger
+from typing import Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from bavli_reports.models import ReportSummary
+
+logger = getLogger(__name__)
+
+# what a report run needs, gspread and google-auth included, kept out of the way until it is needed
+HEAVY_MODULES: Tuple[str, ...] = ("bavli_reports.report_worker",)
+
+# the stages of `do_report_work` in the order they run, for turning the running stage into a fraction of the run
+STAGES: Tuple[str, ...] = ("auth", "fetch", "normalize", "match", "format", "write", "save state")
+
+
+class JobCancelled(Exception):
+    """Raised inside a report run once its job was cancelled"""
+
+
+class ReportJob:
+    """A single `do_report_work` run, with its progress and a way to stop it
+
+    A cancelled job stops at the next progress report of the run, whatever was already written to the sheet stays.
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.future: Optional[Future] = None
+        self.stage: Optional[str] = None
+        self.done = 0
+        self.total = 0
+        self._fraction = 0.0
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self) -> "ReportSummary":
+        from bavli_reports.report_worker import do_report_work
+
+        return do_report_work(progress_func=self.report_progress, **self.kwargs)
+
+    def report_progress(self, stage: str, done: int, total: int):
+        if self._cancelled.is_set():
+            raise JobCancelled(f"cancelled while in {stage}")
+
+        with self._lock:
+            self.stage, self.done, self.total = stage, done, total
+            index = STAGES.index(stage) if stage in STAGES else 0
+            # stages can come around again (e.g. `write`), the bar never goes backwards
+            self._fraction = max(self._fraction, (index + (done / total if total else 0)) / len(STAGES))
+
+    def progress(self) -> Tuple[Optional[str], int, int, float]:
+        """The running stage, how much of it is done out of how much, and the fraction of the whole run done"""
+        with self._lock:
+            return self.stage, self.done, self.total, self._fraction
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None:
+            # a job that did not start yet never will
+            self.future.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def finished(self) -> bool:
+        return self.future is not None and self.future.done()
+
+
+class JobManager:
+    """Runs report jobs one at a time on a single worker thread, so runs never overlap"""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="report")
+        self.current: Optional[ReportJob] = None
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None and not self.current.finished()
+
+    def submit(self, **kwargs) -> ReportJob:
+        """Starts a `do_report_work` run with `kwargs`, fails if one is still running"""
+        if self.busy:
+            raise RuntimeError("a report is already running")
+
+        job = ReportJob(**kwargs)
+        job.future = self._executor.submit(job.run)
+        self.current = job
+        return job
+
+    def cancel(self):
+        if self.current is not None:
+            self.current.cancel()
+
+    def shutdown(self, wait: bool = False):
+        self.cancel()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def prewarm() -> threading.Thread:
+    """Imports `HEAVY_MODULES` on a background thread, so the first report does not wait for them"""
+    def load():
+        for module in HEAVY_MODULES:
+            try:
+                importlib.import_module(module)
+            except Exception as e:
+                # the report itself will fail on it with a proper message
+                logger.debug(f"Could not prewarm {module}: {e}")
+
+    thread = threading.Thread(target=load, name="prewarm", daemon=True)
+    thread.start()
+    return thread
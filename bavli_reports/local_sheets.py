@@ -0,0 +1,335 @@
+import csv
+import hashlib
+import itertools
+import os
+import threading
+from typing import List, Dict, Optional, Tuple
+
+from gspread import Cell, WorksheetNotFound, SpreadsheetNotFound
+from gspread.utils import a1_range_to_grid_range
+
+
+_WHITE = {"red": 1.0, "green": 1.0, "blue": 1.0}
+
+
+class LocalResponse:
+    def __init__(self, body: dict):
+        self._body = body
+
+    def json(self) -> dict:
+        return self._body
+
+
+def _split_range_name(range_name: str) -> Tuple[Optional[str], str]:
+    if "!" not in range_name:
+        # a quoted name on its own is a whole worksheet
+        if range_name.startswith("'") and range_name.endswith("'"):
+            return range_name[1:-1].replace("''", "'"), ""
+        return None, range_name
+    title, cells = range_name.rsplit("!", 1)
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    return title, cells
+
+
+def _to_string(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class LocalWorksheet:
+    """In memory stand-in for a gspread `Worksheet`, supporting only what `google_connection` calls"""
+
+    offline = True
+
+    def __init__(self, spreadsheet: "LocalSpreadsheet", title: str, sheet_id: int, rows: List[List[str]] = None,
+                 row_count: int = 1000, col_count: int = 26):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.rows: List[List[str]] = [list(map(_to_string, row)) for row in rows or []]
+        self.formats: List[dict] = []
+        self._row_count = row_count
+        self.col_count = col_count
+
+    @property
+    def row_count(self) -> int:
+        return max(self._row_count, len(self.rows))
+
+    def get_values(self) -> List[List[str]]:
+        values = self.values(1, len(self.rows))
+        width = max((len(row) for row in values), default=0)
+        return [row + [""] * (width - len(row)) for row in values]
+
+    def values(self, first_row: int, last_row: int) -> List[List[str]]:
+        """Rows `first_row` to `last_row` (1-based, inclusive) the way the API returns them, no trailing blanks"""
+        values = []
+        for row in self.rows[first_row - 1:last_row]:
+            row = list(row)
+            while row and row[-1] == "":
+                row.pop()
+            values.append(row)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def write(self, first_row: int, first_column: int, values: List[List]):
+        for i, row in enumerate(values):
+            row_index = first_row - 1 + i
+            if row_index >= len(self.rows):
+                self.rows.extend([] for _ in range(row_index - len(self.rows) + 1))
+            target = self.rows[row_index]
+            end = first_column - 1 + len(row)
+            if end > len(target):
+                target.extend([""] * (end - len(target)))
+            target[first_column - 1:end] = map(_to_string, row)
+
+    def background_colors(self) -> Dict[Tuple[int, int], dict]:
+        """The background color every (0-based row, column) cell that has values around it ends up with, after
+        every format applied so far. White cells are left out, painting a cell white is the same as not painting it."""
+        colors: Dict[Tuple[int, int], dict] = {}
+        for repeat_cell in self.formats:
+            grid = repeat_cell["range"]
+            color = repeat_cell["cell"]["userEnteredFormat"].get("backgroundColor")
+            for r in range(grid.get("startRowIndex", 0), min(grid.get("endRowIndex", len(self.rows)), len(self.rows))):
+                for c in range(grid.get("startColumnIndex", 0), grid.get("endColumnIndex", self.col_count)):
+                    if color and color != _WHITE:
+                        colors[r, c] = color
+                    else:
+                        colors.pop((r, c), None)
+        return colors
+
+    def findall(self, query: str) -> List[Cell]:
+        return [
+            Cell(r, c, value)
+            for r, row in enumerate(self.rows, 1) for c, value in enumerate(row, 1) if value == query
+        ]
+
+
+class LocalSpreadsheet:
+    """In memory stand-in for a gspread `Spreadsheet`, loaded from (and saved to) CSV or XLSX files"""
+
+    # tells the rate limiter and the sheet cache there is no API behind this one
+    offline = True
+    _ids = itertools.count(1)
+
+    def __init__(self, client: "LocalClient" = None, title: str = "local", spreadsheet_id: str = None):
+        self.client = client
+        self.title = title
+        self.id = spreadsheet_id or f"local-{next(self._ids)}"
+        self.worksheets_list: List[LocalWorksheet] = []
+        self.version = 1
+        self._lock = threading.Lock()
+
+    def _bump(self):
+        self.version += 1
+
+    def _add_worksheet(self, title: str, rows: int, cols: int, values: List[List] = None) -> LocalWorksheet:
+        if any(ws.title == title for ws in self.worksheets_list):
+            raise ValueError(f"a sheet with the name {title} already exists")
+        sheet_id = max((ws.id for ws in self.worksheets_list), default=-1) + 1
+        worksheet = LocalWorksheet(self, title, sheet_id, values, rows, cols)
+        self.worksheets_list.append(worksheet)
+        return worksheet
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, values: List[List] = None) -> LocalWorksheet:
+        with self._lock:
+            worksheet = self._add_worksheet(title, rows, cols, values)
+            self._bump()
+            return worksheet
+
+    def _worksheet_by_id(self, sheet_id: Optional[int]) -> LocalWorksheet:
+        return next((ws for ws in self.worksheets_list if ws.id == sheet_id), self.sheet1)
+
+    def worksheets(self) -> List[LocalWorksheet]:
+        return list(self.worksheets_list)
+
+    def get_worksheet(self, index: int) -> LocalWorksheet:
+        try:
+            return self.worksheets_list[index]
+        except IndexError:
+            raise WorksheetNotFound(f"index {index} not found")
+
+    def worksheet(self, title: str) -> LocalWorksheet:
+        for worksheet in self.worksheets_list:
+            if worksheet.title == title:
+                return worksheet
+        raise WorksheetNotFound(title)
+
+    @property
+    def sheet1(self) -> LocalWorksheet:
+        return self.get_worksheet(0)
+
+    def _worksheet_for_range(self, range_name: str) -> Tuple[LocalWorksheet, dict]:
+        title, cells = _split_range_name(range_name)
+        worksheet = self.worksheet(title) if title is not None else self.sheet1
+        return worksheet, a1_range_to_grid_range(cells)
+
+    def values_get(self, range_name: str, params: dict = None) -> dict:
+        worksheet, grid = self._worksheet_for_range(range_name)
+        first_row = grid.get("startRowIndex", 0) + 1
+        last_row = grid.get("endRowIndex", worksheet.row_count)
+        values = worksheet.values(first_row, last_row)
+        return {"range": range_name, "values": values} if values else {"range": range_name}
+
+    def values_batch_get(self, ranges: List[str], params: dict = None) -> dict:
+        return {"spreadsheetId": self.id, "valueRanges": [self.values_get(range_name) for range_name in ranges]}
+
+    def values_batch_update(self, params: dict = None, body: dict = None) -> dict:
+        with self._lock:
+            for data in (body or {}).get("data", []):
+                worksheet, grid = self._worksheet_for_range(data["range"])
+                worksheet.write(grid.get("startRowIndex", 0) + 1, grid.get("startColumnIndex", 0) + 1, data["values"])
+            self._bump()
+        return {"spreadsheetId": self.id}
+
+    def batch_update(self, body: dict) -> dict:
+        """Applies the `repeatCell`, `addSheet`, `updateSheetProperties` (title and size) and `updateCells`
+        (clearing only) requests, every other kind is ignored"""
+        replies = []
+        with self._lock:
+            for request in body.get("requests", []):
+                reply = {}
+                if "repeatCell" in request:
+                    worksheet = self._worksheet_by_id(request["repeatCell"]["range"].get("sheetId"))
+                    worksheet.formats.append(request["repeatCell"])
+                elif "addSheet" in request:
+                    properties = request["addSheet"]["properties"]
+                    grid = properties.get("gridProperties", {})
+                    worksheet = self._add_worksheet(
+                        properties["title"], grid.get("rowCount", 1000), grid.get("columnCount", 26)
+                    )
+                    reply = {"addSheet": {"properties": {
+                        "sheetId": worksheet.id, "title": worksheet.title, "index": len(self.worksheets_list) - 1,
+                        "sheetType": "GRID",
+                        "gridProperties": {"rowCount": worksheet.row_count, "columnCount": worksheet.col_count},
+                    }}}
+                elif "updateSheetProperties" in request:
+                    properties = request["updateSheetProperties"]["properties"]
+                    worksheet = self._worksheet_by_id(properties.get("sheetId"))
+                    title = properties.get("title", worksheet.title)
+                    if any(ws.title == title for ws in self.worksheets_list if ws is not worksheet):
+                        raise ValueError(f"a sheet with the name {title} already exists")
+                    worksheet.title = title
+                    grid = properties.get("gridProperties", {})
+                    worksheet._row_count = grid.get("rowCount", worksheet._row_count)
+                    worksheet.col_count = grid.get("columnCount", worksheet.col_count)
+                    del worksheet.rows[worksheet._row_count:]
+                elif "updateCells" in request and "rows" not in request["updateCells"]:
+                    worksheet = self._worksheet_by_id(request["updateCells"]["range"].get("sheetId"))
+                    worksheet.rows, worksheet.formats = [], []
+                replies.append(reply)
+            self._bump()
+        return {"spreadsheetId": self.id, "replies": replies}
+
+    def save(self, path: str):
+        """Saves every worksheet into a single .xlsx file, or as `<path>/<title>.csv` files for any other path"""
+        if path.lower().endswith(".xlsx"):
+            save_xlsx(self, path)
+            return
+
+        os.makedirs(path, exist_ok=True)
+        for worksheet in self.worksheets_list:
+            with open(os.path.join(path, f"{worksheet.title}.csv"), "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(worksheet.rows)
+
+
+class LocalClient:
+    """In memory stand-in for a gspread `Client`
+
+    `open_by_url` hands back spreadsheets registered with `add`, or loads the url as a path to a .csv or .xlsx file
+    (`file://` urls work too). Every spreadsheet stays open, so whatever a report writes can be saved afterwards.
+    """
+
+    offline = True
+
+    def __init__(self):
+        self.spreadsheets: Dict[str, LocalSpreadsheet] = {}
+        self._lock = threading.Lock()
+
+    def add(self, url: str, spreadsheet: LocalSpreadsheet) -> LocalSpreadsheet:
+        spreadsheet.client = self
+        self.spreadsheets[url] = spreadsheet
+        return spreadsheet
+
+    def open_by_url(self, url: str) -> LocalSpreadsheet:
+        with self._lock:
+            if url not in self.spreadsheets:
+                path = url[len("file://"):] if url.startswith("file://") else url
+                if path.lower().endswith(".csv") and os.path.isfile(path):
+                    self.add(url, load_csv(path))
+                elif path.lower().endswith(".xlsx") and os.path.isfile(path):
+                    self.add(url, load_xlsx(path))
+                else:
+                    raise SpreadsheetNotFound(url)
+            return self.spreadsheets[url]
+
+    def request(self, method: str, endpoint: str, params: dict = None, **kwargs) -> LocalResponse:
+        """Only answers the Drive `files.get` used to find a spreadsheet's revision"""
+        spreadsheet_id = endpoint.rstrip("/").rsplit("/", 1)[-1]
+        for spreadsheet in self.spreadsheets.values():
+            if spreadsheet.id == spreadsheet_id:
+                return LocalResponse({"version": str(spreadsheet.version), "modifiedTime": ""})
+        raise SpreadsheetNotFound(spreadsheet_id)
+
+
+def _file_id(path: str) -> str:
+    # stable across runs (the incremental state is keyed by it) and safe to use in file names
+    return "local-" + hashlib.blake2b(os.path.abspath(path).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def load_csv(path: str, title: str = None) -> LocalSpreadsheet:
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rows = list(csv.reader(f))
+
+    spreadsheet = LocalSpreadsheet(title=name, spreadsheet_id=_file_id(path))
+    spreadsheet.add_worksheet(title or name, rows=len(rows), values=rows)
+    return spreadsheet
+
+
+def load_xlsx(path: str) -> LocalSpreadsheet:
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError("reading .xlsx files needs openpyxl, run `pip install openpyxl`")
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    spreadsheet = LocalSpreadsheet(title=os.path.splitext(os.path.basename(path))[0], spreadsheet_id=_file_id(path))
+    for ws in workbook.worksheets:
+        rows = [list(row) for row in ws.iter_rows(values_only=True)]
+        spreadsheet.add_worksheet(ws.title, rows=len(rows), values=rows)
+    workbook.close()
+    return spreadsheet
+
+
+def save_xlsx(spreadsheet: LocalSpreadsheet, path: str):
+    try:
+        import openpyxl
+        from openpyxl.styles import PatternFill
+        from openpyxl.utils import get_column_letter
+    except ImportError:
+        raise ImportError("writing .xlsx files needs openpyxl, run `pip install openpyxl`")
+
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for worksheet in spreadsheet.worksheets_list:
+        ws = workbook.create_sheet(worksheet.title)
+        for row in worksheet.rows:
+            ws.append(row)
+
+        for repeat_cell in worksheet.formats:
+            color = repeat_cell["cell"]["userEnteredFormat"].get("backgroundColor")
+            if not color:
+                continue
+            rgb = "".join(f"{round(color.get(c, 0.0) * 255):02X}" for c in ("red", "green", "blue"))
+            fill = PatternFill(start_color=rgb, end_color=rgb, fill_type="solid")
+            grid = repeat_cell["range"]
+            for r in range(grid.get("startRowIndex", 0), grid.get("endRowIndex", len(worksheet.rows))):
+                for c in range(grid.get("startColumnIndex", 0), grid.get("endColumnIndex", worksheet.col_count)):
+                    ws[f"{get_column_letter(c + 1)}{r + 1}"].fill = fill
+
+    workbook.save(path)
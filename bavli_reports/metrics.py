@@ -0,0 +1,116 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Dict, Optional, Callable, Iterator, List
+
+# the metrics of the report running in the current context, threads spawned for a report have to copy the context
+# (see `in_context`) for their API calls to be counted
+current_metrics: ContextVar[Optional["RunMetrics"]] = ContextVar("current_metrics", default=None)
+
+
+class RunMetrics:
+    """Wall time per stage, API calls per quota (and per spreadsheet), bytes over the wire and time spent waiting on
+    the rate limiter"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.api_calls: Dict[str, int] = {}
+        self.spreadsheet_api_calls: Dict[Optional[str], Dict[str, int]] = {}
+        # what to call each spreadsheet in the summary, e.g. "bavli"
+        self.spreadsheet_names: Dict[str, str] = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.rate_limit_sleep = 0.0
+        self.retries = 0
+        self._running: Optional[str] = None
+        self._started = 0.0
+        self._lock = threading.Lock()
+
+    def mark(self, name: Optional[str]):
+        """Ends the running stage (if any) and starts timing `name`"""
+        now = time.perf_counter()
+        with self._lock:
+            if self._running is not None:
+                self.stages[self._running] = self.stages.get(self._running, 0.0) + now - self._started
+            self._running, self._started = name, now
+
+    def finish(self):
+        self.mark(None)
+
+    @contextmanager
+    def activate(self) -> Iterator["RunMetrics"]:
+        token = current_metrics.set(self)
+        try:
+            yield self
+        finally:
+            current_metrics.reset(token)
+
+    def add_api_call(self, quota: str, spreadsheet_id: str = None):
+        with self._lock:
+            self.api_calls[quota] = self.api_calls.get(quota, 0) + 1
+            calls = self.spreadsheet_api_calls.setdefault(spreadsheet_id, {})
+            calls[quota] = calls.get(quota, 0) + 1
+
+    def name_spreadsheet(self, spreadsheet_id: str, name: str):
+        with self._lock:
+            existing = self.spreadsheet_names.get(spreadsheet_id)
+            # both reports can live in the same spreadsheet
+            self.spreadsheet_names[spreadsheet_id] = f"{existing} & {name}" if existing and existing != name else name
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def add_sleep(self, seconds: float):
+        with self._lock:
+            self.rate_limit_sleep += seconds
+
+    def add_bytes(self, sent: int, received: int):
+        with self._lock:
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+                "total_seconds": round(sum(self.stages.values()), 4),
+                "api_calls": dict(self.api_calls),
+                "spreadsheet_api_calls": {
+                    self.spreadsheet_names.get(spreadsheet_id, spreadsheet_id or "other"): dict(calls)
+                    for spreadsheet_id, calls in self.spreadsheet_api_calls.items()
+                },
+                "retries": self.retries,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "rate_limit_sleep": round(self.rate_limit_sleep, 4),
+            }
+
+    def summary_lines(self) -> List[str]:
+        metrics = self.to_dict()
+        return [
+            "Timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in metrics["stages"].items()),
+            f"API calls: {metrics['api_calls'].get('read', 0)} reads, {metrics['api_calls'].get('write', 0)} writes"
+            f" ({metrics['retries']} retried), {metrics['bytes_sent'] / 1024:.1f}KB sent, "
+            f"{metrics['bytes_received'] / 1024:.1f}KB received, {metrics['rate_limit_sleep']:.2f}s waiting on quota",
+            "API calls per sheet: " + "; ".join(
+                f"{name}: {calls.get('read', 0)} reads, {calls.get('write', 0)} writes"
+                for name, calls in metrics["spreadsheet_api_calls"].items()
+            ),
+        ]
+
+
+def in_context(func: Callable) -> Callable:
+    """Wraps `func` to run in a copy of the caller's context, for handing work over to other threads"""
+    context = copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+
+def count_response_bytes(response, *args, **kwargs):
+    """`requests` response hook adding the size of every request and response to the current report's metrics"""
+    metrics = current_metrics.get()
+    if metrics is not None:
+        body = response.request.body or b""
+        metrics.add_bytes(len(body), len(response.content))
+    return response
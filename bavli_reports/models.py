@@ -1,37 +1,77 @@
 import dataclasses
-import datetime
+import json
+import random
 import string
+import threading
+from collections import defaultdict, deque
+from itertools import zip_longest
 from enum import Enum
 
 from gspread import Worksheet
+from gspread.exceptions import APIError
 from gspread.utils import a1_range_to_grid_range
-from time import sleep
-from typing import List, Tuple
+from time import sleep, monotonic
+from typing import List, Tuple, Dict, Deque, Callable, Sequence, Iterator
+
+from bavli_reports.metrics import current_metrics
 
 
 class RowDiffs:
+    __slots__ = ("bavli_row", "external_row")
+
     @staticmethod
-    def fit_rows(row1: list, row2: list):
-        diff = len(row1) - len(row2)
-        if diff:
-            extend_row = row2 if diff > 0 else row1
-            extend_row.extend([""] * diff)
-
-    def __init__(self, bavli_row, external_row):
-        RowDiffs.fit_rows(bavli_row, external_row)
+    def fit_rows(row1: Sequence, row2: Sequence) -> Tuple[Tuple, Tuple]:
+        width = max(len(row1), len(row2))
+        return tuple(row1) + ("",) * (width - len(row1)), tuple(row2) + ("",) * (width - len(row2))
+
+    def __init__(self, bavli_row: Sequence, external_row: Sequence):
+        # rows are kept as they are (and shared with the extracted values), padding only happens when needed
         self.bavli_row = bavli_row
         self.external_row = external_row
 
     def find_diffs(self):
-        return [i for i, val in enumerate(self.bavli_row) if val != self.external_row[i]]
+        return [
+            i for i, (bavli_val, external_val) in enumerate(zip_longest(self.bavli_row, self.external_row, fillvalue=""))
+            if bavli_val != external_val
+        ]
 
     def prettify(self, key: tuple):
+        bavli_row, external_row = RowDiffs.fit_rows(self.bavli_row, self.external_row)
         return {
-            ("bavli", *key): self.bavli_row,
-            ("external", *key): self.external_row
+            ("bavli", *key): list(bavli_row),
+            ("external", *key): list(external_row)
         }
 
 
+class MatchIndex:
+    """Buckets rows by their match column so each lookup is O(1)
+
+    Duplicates are kept in their original order, so the first unmatched row wins just like a linear scan would.
+    """
+
+    def __init__(self, rows: List[Sequence], column: int = 0):
+        self.rows = rows
+        self.column = column
+        self._buckets: Dict[str, Deque[int]] = defaultdict(deque)
+        for i, row in enumerate(rows):
+            self._buckets[self.key(row)].append(i)
+        self._taken = set()
+
+    def key(self, row: Sequence):
+        return row[self.column]
+
+    def pop_match(self, truth: Sequence) -> Sequence:
+        bucket = self._buckets.get(self.key(truth))
+        if not bucket:
+            return ()
+        i = bucket.popleft()
+        self._taken.add(i)
+        return self.rows[i]
+
+    def remaining(self) -> List[Sequence]:
+        return [row for i, row in enumerate(self.rows) if i not in self._taken]
+
+
 class BackgroundColor(Enum):
     RED = {"backgroundColor": {
         "red": 1.0,
@@ -76,20 +116,70 @@ class Format:
     cells_color: List[Tuple[int, int, BackgroundColor]] = dataclasses.field(default_factory=list)
 
 
+@dataclasses.dataclass
+class MatchDiffs:
+    # per matched pair, which columns differ
+    masks: List[Tuple[bool, ...]] = dataclasses.field(default_factory=list)
+    # per column, in how many matched pairs it differs
+    column_counts: List[int] = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class GroupedValues:
+    # sheet rows, ordered by key
+    rows: List[List] = dataclasses.field(default_factory=list)
+    # per key group, the index right after its last row
+    group_ends: List[int] = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class ReportSummary:
+    mismatches: int = 0
+    outliers: int = 0
+    invalids: int = 0
+    matches: int = 0
+    diffs: int = 0
+    # see `RunMetrics.to_dict`
+    metrics: dict = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass
+class PrefetchedReport:
+    """A spreadsheet opened ahead of time along with its worksheets, see `Prefetcher`
+
+    Only the spreadsheet is reused by a run, the worksheets (and their grid sizes) are as they were when fetched and
+    are only there to be shown.
+    """
+    spreadsheet: object
+    worksheets: List[Worksheet]
+    fetched_at: float = dataclasses.field(default_factory=monotonic)
+
+    def describe(self) -> str:
+        # the grid size, which is not how many rows are filled in
+        return ", ".join(f"{ws.title} ({ws.row_count}x{ws.col_count} grid)" for ws in self.worksheets)
+
+
 class Range:
     @classmethod
     def from_first_and_values(cls, values: List[List], first_column="A", first_row=1):
-        second_column = cls.int_to_column(len(values[0]))
+        second_column = cls.int_to_column(max(len(row) for row in values))
         second_row = first_row + len(values) - 1
         return cls(first_column, first_row, second_column, second_row)
 
     @classmethod
     def int_to_column(cls, num):
-        if num < 1:
-            return ""
-        if num // 26:
-            return string.ascii_uppercase[(num // 26) - 1] + string.ascii_uppercase[num % 26 - 1]
-        return string.ascii_uppercase[num % 26 - 1]
+        column = ""
+        while num > 0:
+            num, remainder = divmod(num - 1, 26)
+            column = string.ascii_uppercase[remainder] + column
+        return column
+
+    @classmethod
+    def column_to_int(cls, column: str) -> int:
+        num = 0
+        for letter in column:
+            num = num * 26 + string.ascii_uppercase.index(letter) + 1
+        return num
 
     def __init__(self, first_column="A", first_row=1, second_column="Z", second_row=1):
         self.first_column: str = first_column
@@ -105,38 +195,169 @@ class Range:
         self.second_row += num
 
 
-class WriteRequests:
-    def __init__(self, quota: int = 60):
-        self.qouta = quota
-        self._write_requests = 0
-        self.last_request: datetime.datetime = datetime.datetime.now()
+class Quota(Enum):
+    READ = "read"
+    WRITE = "write"
+
+
+class TokenBucket:
+    """Thread safe token bucket that refills `capacity` tokens every `period` seconds
+
+    A caller that finds the bucket empty reserves its token right away and sleeps only until that token
+    becomes available, so concurrent callers queue up instead of all waking up at once.
+    """
 
-    @property
-    def write_requests(self):
-        return self._write_requests
+    def __init__(self, capacity: int = 60, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._tokens: float = capacity
+        self._last = monotonic()
+        self._lock = threading.Lock()
 
-    @write_requests.setter
-    def write_requests(self, val):
-        if self._write_requests + val > self.qouta:
-            next_request_time = self.last_request + datetime.timedelta(seconds=60)
-            if datetime.datetime.now() < next_request_time:
-                sleep((next_request_time - datetime.datetime.now()).seconds + 1)
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
 
-        self._write_requests = (self._write_requests + val) % self.qouta
+    def acquire(self, tokens: int = 1) -> float:
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
 
-    def __add__(self, other):
-        self.write_requests = other
-        return self
+        if wait:
+            sleep(wait)
+        return wait
+
+
+class RateLimiter:
+    """Keeps every Google Sheets API call inside the read and write quotas
+
+    Calls that still get throttled (429) or hit a server error (5xx) are retried with exponential backoff.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+            self,
+            read_quota: int = 60,
+            write_quota: int = 60,
+            period: float = 60.0,
+            max_retries: int = 5,
+            backoff: float = 1.0,
+            max_backoff: float = 64.0
+    ):
+        self.buckets: Dict[Quota, TokenBucket] = {
+            Quota.READ: TokenBucket(read_quota, period),
+            Quota.WRITE: TokenBucket(write_quota, period),
+        }
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @classmethod
+    def _status_code(cls, error: APIError) -> int:
+        return getattr(error.response, "status_code", 0)
+
+    def call(self, quota: Quota, func: Callable, *args, spreadsheet_id: str = None, **kwargs):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            # accounted per spreadsheet in the metrics of the running report
+            metrics.add_api_call(quota.value, spreadsheet_id)
+
+        # local stand-ins for the API (see `local_sheets`) have no quota to keep
+        if getattr(getattr(func, "__self__", None), "offline", False):
+            return func(*args, **kwargs)
+
+        attempt = 0
+        while True:
+            waited = self.buckets[quota].acquire()
+
+            try:
+                return func(*args, **kwargs)
+            except APIError as e:
+                if attempt >= self.max_retries or self._status_code(e) not in self.RETRY_STATUSES:
+                    raise
+                backoff = min(self.max_backoff, self.backoff * 2 ** attempt) + random.random()
+                sleep(backoff)
+                waited += backoff
+                attempt += 1
+                if metrics is not None:
+                    metrics.add_retry()
+            finally:
+                if metrics is not None and waited:
+                    metrics.add_sleep(waited)
+
+    def read(self, func: Callable, *args, spreadsheet_id: str = None, **kwargs):
+        return self.call(Quota.READ, func, *args, spreadsheet_id=spreadsheet_id, **kwargs)
+
+    def write(self, func: Callable, *args, spreadsheet_id: str = None, **kwargs):
+        return self.call(Quota.WRITE, func, *args, spreadsheet_id=spreadsheet_id, **kwargs)
+
+
+# keep every single API request body well below what the Sheets API accepts
+MAX_BATCH_BYTES: int = 2_000_000
+
+
+def split_by_size(items: List[dict], max_bytes: int = MAX_BATCH_BYTES) -> Iterator[List[dict]]:
+    batch, size = [], 0
+    for item in items:
+        item_size = len(json.dumps(item, ensure_ascii=False))
+        if batch and size + item_size > max_bytes:
+            yield batch
+            batch, size = [], 0
+        batch.append(item)
+        size += item_size
+
+    if batch:
+        yield batch
+
+
+def _merge_repeat_cell(last: dict, new: dict) -> bool:
+    """Grows `last` to also cover `new` when both paint the same format on touching ranges"""
+    last, new = last.get("repeatCell"), new.get("repeatCell")
+    if not last or not new or last["cell"] != new["cell"] or last["fields"] != new["fields"]:
+        return False
+
+    last_range, new_range = last["range"], new["range"]
+    if last_range.get("sheetId") != new_range.get("sheetId"):
+        return False
+
+    same_columns = all(last_range.get(k) == new_range.get(k) for k in ("startColumnIndex", "endColumnIndex"))
+    if same_columns and last_range.get("endRowIndex") == new_range.get("startRowIndex"):
+        last_range["endRowIndex"] = new_range.get("endRowIndex")
+        return True
+
+    same_rows = all(last_range.get(k) == new_range.get(k) for k in ("startRowIndex", "endRowIndex"))
+    if same_rows and last_range.get("endColumnIndex") == new_range.get("startColumnIndex"):
+        last_range["endColumnIndex"] = new_range.get("endColumnIndex")
+        return True
+
+    return False
 
 
 class FormatRequest:
+    """A `batch_update` body that run-length merges formats as they are added
+
+    A request that paints the same format right below (or right beside) the previous one just grows the previous
+    one's range. Only the last request is ever merged into, so the order in which formats override each other
+    stays the same.
+    """
+
     def __init__(self):
         self.request = {
             "requests": []
         }
 
     def add_request(self, single_request):
-        self.request.get("requests").append(single_request)
+        requests = self.request.get("requests")
+        if requests and _merge_repeat_cell(requests[-1], single_request):
+            return
+        requests.append(single_request)
+
+    def batches(self, max_bytes: int = MAX_BATCH_BYTES) -> Iterator[dict]:
+        for batch in split_by_size(self.request["requests"], max_bytes):
+            yield {"requests": batch}
 
 
 def format_cells(range_name, cell_format, ws_id):
@@ -0,0 +1,123 @@
+import re
+import sys
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional, Sequence
+
+from bavli_reports.models import MatchIndex
+
+# hebrew final letters are written differently at the end of a word, compare them as their regular form
+_FINAL_LETTERS = {"ך": "כ", "ם": "מ", "ן": "נ", "ף": "פ", "ץ": "צ"}
+# niqqud and cantillation marks, and the quotes used in abbreviations (e.g. רח' / ת"א)
+_DROPPED = "".join(map(chr, range(0x0591, 0x05C8))) + "\"'׳״`"
+_TRANSLATION = str.maketrans({**_FINAL_LETTERS, **{c: None for c in _DROPPED}})
+
+# a house number with an optional letter suffix, e.g. `12`, `12A`, `12 א`, `12-b`, `12/ג`
+_HOUSE = re.compile(r"0*(\d+)\s*[-/]?\s*([^\W\d_]?)")
+_ZIP = re.compile(r"\d+")
+
+# how many edits (per character of the normalized value) still count as the same name
+MAX_EDIT_RATIO: float = 0.2
+# how many normalized values are remembered, bounded since the GUI and the batch runner live through many reports
+NORMALIZE_CACHE_SIZE: int = 2 ** 16
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_text(value: str) -> str:
+    """Casefolded, with whitespace collapsed, hebrew final letters made regular and niqqud and quotes dropped"""
+    return sys.intern(" ".join(value.translate(_TRANSLATION).casefold().split()))
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_key(key: Tuple[str, str]) -> Optional[Tuple[str, str]]:
+    """The (house, zip) key with the house number's suffix and the zip code's separators normalized, None when
+    either of them is still not a number"""
+    house, zip_code = (normalize_text(value) for value in key)
+    house_match = _HOUSE.fullmatch(house)
+    zip_code = zip_code.replace(" ", "").replace("-", "")
+    if not house_match or not _ZIP.fullmatch(zip_code):
+        return None
+    return sys.intern("".join(house_match.groups())), sys.intern(zip_code.lstrip("0") or "0")
+
+
+def normalize_values(
+        valid_values: Dict[Tuple, List],
+        invalid_values: Dict[Tuple, List]
+) -> Tuple[Dict[Tuple, List], Dict[Tuple, List]]:
+    """Re-keys the extracted rows by their normalized key, merging keys that only differ in how they were typed
+
+    Invalid rows whose key is valid once normalized (e.g. house `12A`) join the valid ones.
+    """
+    normalized: Dict[Tuple, List] = defaultdict(list)
+    still_invalid: Dict[Tuple, List] = {}
+    for key, rows in valid_values.items():
+        normalized[normalize_key(key) or key].extend(rows)
+    for key, rows in invalid_values.items():
+        normalized_key = normalize_key(key)
+        if normalized_key:
+            normalized[normalized_key].extend(rows)
+        else:
+            still_invalid[key] = rows
+
+    return normalized, still_invalid
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance between `a` and `b`, gives up with `max_distance + 1` as soon as it is out of reach"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if len(a) > len(b):
+        a, b = b, a
+
+    previous = list(range(len(a) + 1))
+    for i, b_char in enumerate(b, 1):
+        current = [i]
+        for j, a_char in enumerate(a, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a_char != b_char)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+
+    return previous[-1]
+
+
+class FuzzyMatchIndex(MatchIndex):
+    """A `MatchIndex` over normalized match values, that can also hand out the closest row by edit distance
+
+    Rows are blocked by the length of their normalized value, so a lookup only compares against rows that are
+    short enough an edit away instead of against every remaining row.
+    """
+
+    def __init__(self, rows: List[Sequence], column: int = 0, max_edit_ratio: float = MAX_EDIT_RATIO):
+        super().__init__(rows, column)
+        self.max_edit_ratio = max_edit_ratio
+        self._values = [self.key(row) for row in rows]
+        self._by_length: Dict[int, List[int]] = defaultdict(list)
+        for i, value in enumerate(self._values):
+            self._by_length[len(value)].append(i)
+
+    def key(self, row: Sequence) -> str:
+        return normalize_text(row[self.column])
+
+    def pop_closest(self, truth: Sequence) -> Sequence:
+        """The untaken row whose value is the fewest edits away from `truth`'s (the first one on a tie), if it is
+        close enough"""
+        value = self.key(truth)
+        max_distance = int(len(value) * self.max_edit_ratio)
+        if not max_distance:
+            return ()
+
+        best, best_distance = None, max_distance + 1
+        for length in range(len(value) - max_distance, len(value) + max_distance + 1):
+            for i in self._by_length.get(length, ()):
+                if i in self._taken:
+                    continue
+                distance = edit_distance(value, self._values[i], best_distance)
+                if (distance, i) < (best_distance, best if best is not None else i):
+                    best, best_distance = i, distance
+
+        if best is None:
+            return ()
+        self._buckets[self._values[best]].remove(best)
+        self._taken.add(best)
+        return self.rows[best]
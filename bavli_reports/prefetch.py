@@ -0,0 +1,97 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import lru_cache
+from logging import getLogger
+from time import monotonic
+from typing import Dict, Optional, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from bavli_reports.models import PrefetchedReport
+
+logger = getLogger(__name__)
+
+# a prefetched report is only handed to a run this long after it was fetched, its worksheets may have grown since
+PREFETCH_MAX_AGE: float = 300.0
+# a url that could not be opened is only tried again this long after, opening it may even ask to sign in again
+PREFETCH_RETRY_AFTER: float = 60.0
+
+
+@lru_cache(maxsize=256)
+def is_valid_url(url: str) -> bool:
+    # imported here, keeping it out of the GUI's startup
+    import validators
+
+    return bool(validators.url(url))
+
+
+@lru_cache(maxsize=256)
+def is_spreadsheet_url(url: str) -> bool:
+    """Whether `url` is a url with a spreadsheet id in it, only those are worth opening ahead of time"""
+    from gspread.exceptions import NoValidUrlKeyFound
+    from gspread.utils import extract_id_from_url
+
+    if not is_valid_url(url):
+        return False
+    try:
+        extract_id_from_url(url)
+    except NoValidUrlKeyFound:
+        return False
+    return True
+
+
+class Prefetcher:
+    """Opens spreadsheets (and lists their worksheets) in the background as soon as their url is known
+
+    Every url is fetched once, with the process wide client (see `get_connection`), and fetched again only once
+    what it got is older than `max_age`, or `retry_after` after it failed.
+    """
+
+    def __init__(self, max_age: float = PREFETCH_MAX_AGE, connection=None, retry_after: float = PREFETCH_RETRY_AFTER):
+        self.max_age = max_age
+        self.retry_after = retry_after
+        self.connection = connection
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+        self._futures: Dict[str, Future] = {}
+        # when the fetch of every url was started
+        self._started: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, url: str) -> "PrefetchedReport":
+        from bavli_reports.google_connection import prefetch_report
+
+        return prefetch_report(url, connection=self.connection)
+
+    def _fresh(self, url: str, future: Future) -> bool:
+        if not future.done():
+            return True
+        if future.exception():
+            # a failure is kept (and shown) for a while instead of being tried again on every check
+            return monotonic() - self._started[url] < self.retry_after
+        return monotonic() - future.result().fetched_at < self.max_age
+
+    def prefetch(self, url: str) -> Future:
+        with self._lock:
+            future = self._futures.get(url)
+            if future is None or not self._fresh(url, future):
+                self._started[url] = monotonic()
+                future = self._futures[url] = self._executor.submit(self._fetch, url)
+            return future
+
+    def get(self, url: str) -> Optional["PrefetchedReport"]:
+        """The report fetched for `url`, if it is already done, did not fail and is still fresh"""
+        with self._lock:
+            future = self._futures.get(url)
+        if future is None or not future.done() or future.exception() or not self._fresh(url, future):
+            return None
+        return future.result()
+
+    def error(self, url: str) -> Optional[BaseException]:
+        with self._lock:
+            future = self._futures.get(url)
+        return future.exception() if future is not None and future.done() else None
+
+    def prefetched(self, urls: Iterable[str]) -> Dict[str, "PrefetchedReport"]:
+        return {url: report for url, report in ((url, self.get(url)) for url in urls) if report}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,87 @@
+import dataclasses
+import gzip
+import hashlib
+import json
+import os
+from logging import getLogger
+from typing import List, Dict, Tuple, Optional, Iterable
+
+from bavli_reports import ROOT_DIR
+from bavli_reports.models import RowDiffs
+
+logger = getLogger(__name__)
+
+STATE_DIR = os.path.join(ROOT_DIR, ".report_state")
+
+
+def _key_to_str(key: Tuple) -> str:
+    return json.dumps(list(key), ensure_ascii=False)
+
+
+def fingerprint(values: List[List[List]]) -> str:
+    return hashlib.blake2b(
+        json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+@dataclasses.dataclass
+class ReportState:
+    """What a previous run of a (bavli, external) pair computed and wrote
+
+    `scans` holds the `scan_by_key` result of every intersecting key along with the fingerprint of its inputs,
+    and `rows` holds every row written to the results worksheet (from `first_row` on) with its color name and
+    colored cells.
+    """
+    worksheet_id: int = None
+    first_row: int = None
+    rows: List[List] = dataclasses.field(default_factory=list)
+    scans: Dict[str, Dict] = dataclasses.field(default_factory=dict)
+
+    @staticmethod
+    def path(bavli_id: str, external_id: str, directory: str = None) -> str:
+        # looked up on every call (not bound as a default), so it can be pointed elsewhere
+        return os.path.join(directory or STATE_DIR, f"{bavli_id}_{external_id}.json.gz")
+
+    @classmethod
+    def load(cls, bavli_id: str, external_id: str, directory: str = None) -> Optional["ReportState"]:
+        try:
+            with gzip.open(cls.path(bavli_id, external_id, directory), "rt", encoding="utf-8") as f:
+                return cls(**json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            logger.info(f"No usable previous run, doing the whole thing: {e}")
+            return None
+
+    def save(self, bavli_id: str, external_id: str, directory: str = None):
+        path = self.path(bavli_id, external_id, directory)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(f"{path}.tmp", "wt", encoding="utf-8") as f:
+            json.dump(dataclasses.asdict(self), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def delete(cls, bavli_id: str, external_id: str, directory: str = None):
+        try:
+            os.remove(cls.path(bavli_id, external_id, directory))
+        except FileNotFoundError:
+            pass
+
+    def subset(self, keys: Iterable[Tuple]) -> "ReportState":
+        """The previous scans of `keys` only, without the written rows"""
+        return ReportState(scans={k: self.scans[k] for k in map(_key_to_str, keys) if k in self.scans})
+
+    def get_scan(self, key: Tuple, key_fingerprint: str) -> Optional[Tuple[Dict, List[RowDiffs]]]:
+        scan = self.scans.get(_key_to_str(key))
+        if not scan or scan["fingerprint"] != key_fingerprint:
+            return None
+
+        mismatches = {("bavli", *key): scan["bavli"]} if scan["bavli"] else {}
+        mismatches.update({("external", *key): scan["external"]} if scan["external"] else {})
+        return mismatches, [RowDiffs(bavli_row, external_row) for bavli_row, external_row in scan["matches"]]
+
+    def set_scan(self, key: Tuple, key_fingerprint: str, mismatches: Dict, matches: List[RowDiffs]):
+        self.scans[_key_to_str(key)] = {
+            "fingerprint": key_fingerprint,
+            "bavli": mismatches.get(("bavli", *key), []),
+            "external": mismatches.get(("external", *key), []),
+            "matches": [[m.bavli_row, m.external_row] for m in matches],
+        }
@@ -1,48 +1,69 @@
 import logging
-from typing import Tuple, List, Dict, Callable
-
-from gspread import WorksheetNotFound
-
-from bavli_reports.google_connection import get_report_by_url, extract_values, create_worksheet, write_values, \
-    write_legend, get_connection
-from bavli_reports.models import RowDiffs, BackgroundColor, Format, Range
+import threading
+from operator import ne, itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, List, Dict, Callable, Union
+
+from gspread import WorksheetNotFound, Client, Spreadsheet
+
+from bavli_reports.google_connection import get_report_by_url, extract_values, ReportWriter, get_connection, \
+    get_worksheet, find_worksheet, select_worksheets, extract_worksheets_values, provision_worksheet, fit_worksheet, \
+    report_size, LEGEND_ROWS, cached_revision
+from bavli_reports.metrics import RunMetrics, in_context
+from bavli_reports.models import RowDiffs, BackgroundColor, Range, ReportSummary, MatchDiffs, PrefetchedReport, \
+    GroupedValues
+# `scan_by_key` lives in `engine` now, still importable from here
+from bavli_reports.engine import scan_by_key, reconcile, reconcile_sharded
+from bavli_reports.normalization import normalize_values
+from bavli_reports.report_state import ReportState
 
 BAVLI_REPORT: str = "https://docs.google.com/spreadsheets/d/1nwvOZ1P2jzKfUuQnfA3eslZp9VK-FbhYbw5Npnue9T0/edit#gid=96750267"
 EXTERNAL_REPORT: str = "https://docs.google.com/spreadsheets/d/1nwvOZ1P2jzKfUuQnfA3eslZp9VK-FbhYbw5Npnue9T0/edit#gid=96750267"
+REPORT_RESULTS: str = "Report results"
 
 logger = logging.getLogger(__name__)
 
 
-def get_match_row(truth, check):
-    for row in check:
-        if row[0] == truth[0]:
-            return row
-    return []
-
-
-def scan_by_key(key: Tuple, values: List[List]) -> Tuple[Dict, List[RowDiffs]]:
-    bavli = values[0]
-    external = values[1]
-
-    matches: List[RowDiffs] = []
-    mismatch_bavli = []
-    mismatch_external = external.copy()
-
-    for row in bavli:
-        matched_external_row = get_match_row(row, mismatch_external)
-        if matched_external_row:
-            mismatch_external.remove(matched_external_row)
-            matches.append(RowDiffs(row, matched_external_row))
+def group_values(values: Dict[Tuple, List]) -> GroupedValues:
+    """Lays out `values` as sheet rows ordered the way `format_to_gsheet_values` sorts them, along with where
+    every key group ends, in a single pass
+
+    Keys that only differ by name ("bavli" / "external") make up one group. Only the keys are sorted, and only on
+    the key tuple, rows are compared just against the few other rows of their own group.
+    """
+    grouped = GroupedValues()
+    rows, group_ends = grouped.rows, grouped.group_ends
+
+    def end_group(start: int, width: int):
+        if len(rows) - start > 1:
+            # stable, rows equal in content keep their order
+            rows[start:] = sorted(rows[start:], key=lambda row: row[width:])
+        if len(rows) > start:
+            group_ends.append(len(rows))
+
+    group_key, start, width = None, 0, 0
+    # sorted on the key without its name, the same way rows are grouped
+    for k in sorted(values, key=itemgetter(slice(1, None))):
+        if k[1:] != group_key:
+            end_group(start, width)
+            group_key, start, width = k[1:], len(rows), len(k)
+
+        v = values[k]
+        if type(v) != list:
+            rows.append([*k, *v])
+        elif len(v) == 1:
+            rows.append([*k, *v[0]])
         else:
-            mismatch_bavli.append(row)
+            rows.extend([[*k, *row] for row in v])
+    end_group(start, width)
 
-    mismatches = {("bavli", *key): mismatch_bavli} if mismatch_bavli else {}
-    mismatches.update({("external", *key): mismatch_external} if mismatch_external else {})
-
-    return mismatches, matches
+    return grouped
 
 
 def format_to_gsheet_values(values: Dict[Tuple, List], sort: bool = True) -> List[List]:
+    if sort:
+        return group_values(values).rows
+
     to_return: List[List] = []
     for k, v in values.items():
         if type(v) == list:
@@ -50,101 +71,367 @@ def format_to_gsheet_values(values: Dict[Tuple, List], sort: bool = True) -> Lis
                 to_return.append([*k, *inner_list])
         else:
             to_return.append([*k, *v])
-
-    return sort and sorted(to_return, key=lambda x: tuple(x[1:])) or to_return
+    return to_return
 
 
-def get_formatting_settings(values: List[List], colors: Tuple[BackgroundColor, BackgroundColor]) -> List[Tuple[Range, BackgroundColor]]:
+def get_formatting_settings(
+        values: List[List],
+        colors: Tuple[BackgroundColor, BackgroundColor],
+        group_ends: List[int] = None
+) -> List[Tuple[Range, BackgroundColor]]:
+    """Alternates `colors` between key groups, pass the `group_ends` of `group_values` to not look for them again"""
     if not values:
         return []
 
-    def get_key(line):
-        return line[1:3]
+    if group_ends is None:
+        group_ends = find_group_ends(values)
 
-    cur_color = colors[0]
-    inspecting_key = get_key(values[0])
+    second_column = Range.int_to_column(len(values[0]))
     to_return: List[Tuple[Range, BackgroundColor]] = []
-    cur_range = Range(second_column=Range.int_to_column(len(values[0])))
-    for i, row in enumerate(values):
-        cur_key = get_key(row)
-        if cur_key != inspecting_key:
-            cur_range.second_row = i
-            to_return.append((cur_range, cur_color))
-
-            cur_color = colors[0] if cur_color == colors[1] else colors[1]
-            cur_range = Range(first_row=i+1, second_column=cur_range.second_column)
-            inspecting_key = cur_key
-
-    cur_range.second_row = len(values)
-    to_return.append((cur_range, cur_color))
+    start = 0
+    for i, end in enumerate(group_ends):
+        to_return.append((Range(first_row=start + 1, second_column=second_column, second_row=end), colors[i % 2]))
+        start = end
     return to_return
 
 
+def find_group_ends(values: List[List]) -> List[int]:
+    def get_key(line):
+        return line[1:3]
+
+    group_ends = [i for i in range(1, len(values)) if get_key(values[i]) != get_key(values[i - 1])]
+    group_ends.append(len(values))
+    return group_ends
+
+
+def diff_matches(matches: List[RowDiffs]) -> MatchDiffs:
+    """Compares all matched pairs at once, a whole column at a time, over rows padded to the same width"""
+    if not matches:
+        return MatchDiffs()
+
+    width = max(max(len(m.bavli_row), len(m.external_row)) for m in matches)
+    bavli_columns = zip(*(tuple(m.bavli_row) + ("",) * (width - len(m.bavli_row)) for m in matches))
+    external_columns = zip(*(tuple(m.external_row) + ("",) * (width - len(m.external_row)) for m in matches))
+    column_masks = [tuple(map(ne, b, e)) for b, e in zip(bavli_columns, external_columns)]
+
+    return MatchDiffs(masks=list(zip(*column_masks)), column_counts=[sum(mask) for mask in column_masks])
+
+
+def format_matched_diffs(
+        keyed_matches: List[Tuple[Tuple, RowDiffs]],
+        diffs: MatchDiffs
+) -> Tuple[List[List], List[Tuple[int, int, BackgroundColor]]]:
+    """Lays out every matched pair that has diffs as a bavli row and an external row, sorted by key,
+    along with the (row, column) of each differing cell"""
+    values: List[List] = []
+    cell_colors: List[Tuple[int, int, BackgroundColor]] = []
+    pairs = sorted(
+        ((k, m, mask) for (k, m), mask in zip(keyed_matches, diffs.masks) if any(mask)), key=lambda p: p[0]
+    )
+    for key, match, mask in pairs:
+        for name, row in zip(("bavli", "external"), RowDiffs.fit_rows(match.bavli_row, match.external_row)):
+            values.append([name, *key, *row])
+            # the key takes the first 3 columns, data columns start at the 4th
+            cell_colors.extend((len(values), 4 + i, BackgroundColor.YELLOW) for i, differs in enumerate(mask) if differs)
+
+    return values, cell_colors
+
+
+def section_size(values: Dict[Tuple, List]) -> Tuple[int, int]:
+    """The (rows, columns) `group_values` lays `values` out in, without laying them out"""
+    rows = sum(len(v) if type(v) == list else 1 for v in values.values())
+    columns = max((len(k) + len(row) for k, v in values.items() for row in (v if type(v) == list else [v])), default=0)
+    return rows, columns
+
+
+def matched_diffs_size(matches: List[RowDiffs], diffs: MatchDiffs) -> Tuple[int, int]:
+    """The (rows, columns) `format_matched_diffs` lays the matched pairs out in, without laying them out"""
+    differing = [m for m, mask in zip(matches, diffs.masks) if any(mask)]
+    # a bavli row and an external row for every pair, after the 3 key columns
+    columns = max((3 + max(len(m.bavli_row), len(m.external_row)) for m in differing), default=0)
+    return 2 * len(differing), columns
+
+
+class WritePipeline:
+    """Lays out and writes report sections on a background thread, while the next sections are still being computed
+
+    `open_writer` runs first (on that thread too), then every section in the order it was added. Whatever adds up to a
+    full batch is sent right away (see `ReportWriter.send_full_batches`), the rest goes out with `close`. Once a
+    section fails nothing after it is written, the sections that follow would land in the wrong rows.
+    """
+
+    def __init__(self, open_writer: Callable[[], ReportWriter]):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+        self._failed = threading.Event()
+        self._writer = self._submit(open_writer)
+        self._futures = [self._writer]
+
+    def _submit(self, task: Callable):
+        def run():
+            if self._failed.is_set():
+                return None
+            try:
+                return task()
+            except BaseException:
+                self._failed.set()
+                raise
+
+        return self._executor.submit(in_context(run))
+
+    def add_values(
+            self,
+            values: List[List],
+            colors: Tuple[BackgroundColor, BackgroundColor],
+            cell_colors: List[Tuple[int, int, BackgroundColor]] = None,
+            group_ends: List[int] = None
+    ):
+        def write():
+            writer = self._writer.result()
+            formatting = get_formatting_settings(values, colors, group_ends)
+            writer.add_values(values=values, formatting=formatting, cell_colors=cell_colors)
+            writer.send_full_batches()
+
+        self._futures.append(self._submit(write))
+
+    def close(self, progress: Callable[[int, int], None] = None) -> ReportWriter:
+        """Waits for every section to be written and sends whatever is left, raises what the first failed section
+        did (and sends nothing more)"""
+        for future in self._futures:
+            future.result()
+        self._submit(lambda: self._writer.result().flush(progress)).result()
+        self._executor.shutdown()
+        return self._writer.result()
+
+    def cancel(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_reports(
+        sources: List[Tuple[str, str, Union[int, str]]],
+        connection: Client,
+        logging_func: Callable = logger.info,
+        prefetched: Dict[str, PrefetchedReport] = None
+) -> List[Tuple[Spreadsheet, Dict[Tuple, List], Dict[Tuple, List]]]:
+    """Opens every (url, name, worksheet index or tab patterns) source and pulls its values, all sheets at the
+    same time. Tab patterns (see `select_worksheets`) merge the rows of every matching tab into one index.
+    Sources found in `prefetched` (by url) are not opened again, their worksheets are still listed again since
+    rows may have been added to them after they were prefetched."""
+    def fetch(source: Tuple[str, str, Union[int, str]]):
+        url, name, tabs = source
+        report = (prefetched or {}).get(url)
+        spreadsheet = report.spreadsheet if report else get_report_by_url(url, connection=connection)
+        logging_func(f"Getting the good parts out of the {name} sheet")
+        if isinstance(tabs, str):
+            # never reconcile our own results
+            worksheets = select_worksheets(
+                spreadsheet, tabs, exclude=(REPORT_RESULTS, f"{REPORT_RESULTS} *")
+            )
+            logging_func(f"Merging the {name} tabs: {', '.join(ws.title for ws in worksheets)}")
+            valid_values, invalid_values = extract_worksheets_values(worksheets, name)
+        else:
+            valid_values, invalid_values = extract_values(get_worksheet(spreadsheet, tabs), name)
+        logging_func(f"Got the {name} sheet")
+        return spreadsheet, valid_values, invalid_values
+
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        return list(pool.map(in_context(fetch), sources))
+
+
+def _log(msg, level=logging.INFO):
+    logger.log(level, msg)
+
+
+def _no_progress(stage: str, done: int, total: int):
+    pass
+
+
 def do_report_work(
         bavli_report_url: str = BAVLI_REPORT,
         external_report_url: str = EXTERNAL_REPORT,
         show_matches: bool = False,
-        logging_func: Callable = logger.info
-):
-    logging_func("Getting connecting to Google")
-    connection = get_connection()
-
+        logging_func: Callable = _log,
+        incremental: bool = False,
+        connection: Client = None,
+        metrics: RunMetrics = None,
+        bavli_tabs: str = None,
+        external_tabs: str = None,
+        fuzzy: bool = False,
+        progress_func: Callable[[str, int, int], None] = _no_progress,
+        rotate: bool = True,
+        processes: int = 1,
+        prefetched: Dict[str, PrefetchedReport] = None
+) -> ReportSummary:
+    """`bavli_tabs` / `external_tabs` are comma separated glob patterns of worksheet titles, every matching tab is
+    reconciled as if it were part of a single sheet. Without them only the first worksheet is compared.
+
+    With `fuzzy`, keys are normalized (see `normalize_values`) and rows are matched by their normalized value,
+    falling back to the closest one by edit distance (see `scan_by_key`).
+
+    `progress_func(stage, done, total)` is called whenever a stage starts (with 0 out of 0) and as its work gets
+    done, an exception raised by it (e.g. to cancel the run) stops the run right there.
+
+    Every run writes to a fresh results worksheet, the previous one is renamed to a dated tab, or cleared and
+    written over when not `rotate`. Only an incremental run patches the previous results in place.
+
+    With more than one of `processes`, the keys are matched by a pool of processes (see `reconcile_sharded`).
+
+    `prefetched` are the reports already opened (see `Prefetcher`) by url, those are not opened again."""
+    metrics = metrics or RunMetrics()
+    with metrics.activate():
+        try:
+            summary = _do_report_work(
+                bavli_report_url, external_report_url, show_matches, logging_func, incremental, connection, metrics,
+                bavli_tabs, external_tabs, fuzzy, progress_func, rotate, processes, prefetched
+            )
+        finally:
+            metrics.finish()
+
+    for line in metrics.summary_lines():
+        logging_func(line)
+    summary.metrics = metrics.to_dict()
+    return summary
+
+
+def _do_report_work(
+        bavli_report_url: str,
+        external_report_url: str,
+        show_matches: bool,
+        logging_func: Callable,
+        incremental: bool,
+        connection: Client,
+        metrics: RunMetrics,
+        bavli_tabs: str = None,
+        external_tabs: str = None,
+        fuzzy: bool = False,
+        progress_func: Callable[[str, int, int], None] = _no_progress,
+        rotate: bool = True,
+        processes: int = 1,
+        prefetched: Dict[str, PrefetchedReport] = None
+) -> ReportSummary:
+    def stage(name: str):
+        metrics.mark(name)
+        progress_func(name, 0, 0)
+
+    if not connection:
+        stage("auth")
+        logging_func("Getting connecting to Google")
+        connection = get_connection()
+
+    stage("fetch")
     logging_func("Fetching google sheets")
-    bavli_sheet = get_report_by_url(bavli_report_url, connection=connection)
-    external_sheet = get_report_by_url(external_report_url, connection=connection)
-
-    logging_func("Getting the good parts out of it")
-    bavli_values, invalid_values = extract_values(bavli_sheet.sheet1, "bavli")
-    external_values, invalid_external_values = extract_values(
-        external_sheet.sheet1 if external_report_url != EXTERNAL_REPORT else external_sheet.get_worksheet(1),
-        "external"
+    (bavli_sheet, bavli_values, invalid_values), (external_sheet, external_values, invalid_external_values) = fetch_reports(
+        [
+            (bavli_report_url, "bavli", bavli_tabs or 0),
+            (external_report_url, "external", external_tabs or (0 if external_report_url != EXTERNAL_REPORT else 1)),
+        ],
+        connection=connection,
+        logging_func=logging_func,
+        prefetched=prefetched
     )
+    metrics.name_spreadsheet(bavli_sheet.id, "bavli")
+    metrics.name_spreadsheet(external_sheet.id, "external")
+    if fuzzy:
+        stage("normalize")
+        logging_func("Normalizing house numbers, zip codes and names")
+        bavli_values, invalid_values = normalize_values(bavli_values, invalid_values)
+        external_values, invalid_external_values = normalize_values(external_values, invalid_external_values)
+
     def create_named_key(name: str, key: tuple): return name, *key
 
+    stage("match")
     logging_func("Cutting, shuffling, mixing, cooking and grilling the data")
-    # those which are present in one sheet but not the other
-    outliers = {
-        **{create_named_key("bavli", k): v for k, v in bavli_values.items() if k not in external_values},
-        **{create_named_key("external", k): v for k, v in external_values.items() if k not in bavli_values},
-    }
     # invalids
     invalids = {
         **{create_named_key("bavli", k): v for k, v in invalid_values.items()},
         **{create_named_key("external", k): v for k, v in invalid_external_values.items()}
     }
 
-    intersection = {
-        k: [bavli_values[k], external_values[k]] for k in bavli_values.keys() if k in external_values
-    }
-    # those which are present on both but value is a mismatch
-    mismatches = {}
-    all_matches: List[RowDiffs] = []
-    for k, v in intersection.items():
-        misses, matches = scan_by_key(k, v)
-        mismatches.update(misses)
-        all_matches.extend(matches)
+    # in incremental mode keys whose rows did not change since the last run are not scanned again
+    previous_state = incremental and ReportState.load(bavli_sheet.id, external_sheet.id) or None
+    if processes > 1:
+        logging_func(f"Splitting the work between {processes} processes")
+        reconciliation = reconcile_sharded(
+            bavli_values, external_values, processes, fuzzy, previous_state,
+            progress=lambda done, total: progress_func("match", done, total), keep_state=incremental
+        )
+    else:
+        reconciliation = reconcile(
+            bavli_values, external_values, fuzzy, previous_state,
+            progress=lambda done, total: progress_func("match", done, total), keep_state=incremental
+        )
+    outliers, mismatches, state = reconciliation.outliers, reconciliation.mismatches, reconciliation.state
+    keyed_matches = reconciliation.keyed_matches
+    all_matches: List[RowDiffs] = [m for _, m in keyed_matches]
+
+    if previous_state:
+        logging_func(f"Only {reconciliation.rescanned} out of {reconciliation.intersection} keys changed since the last run")
+
+    stage("format")
+    # matched rows that still differ in some of their fields, the differing cells are marked yellow
+    diffs = diff_matches(all_matches)
+    diffed_matches = sum(1 for mask in diffs.masks if any(mask))
+    rows, cols = report_size([
+        section_size(mismatches), matched_diffs_size(all_matches, diffs), section_size(outliers), section_size(invalids)
+    ])
+
+    def open_writer() -> ReportWriter:
+        # read before anything is written, to tell our own writes from anyone else's (see `ReportWriter.flush`)
+        base_revision = cached_revision(bavli_sheet)
+        try:
+            existing_worksheet = find_worksheet(bavli_sheet, REPORT_RESULTS)
+        except WorksheetNotFound:
+            existing_worksheet = None
+
+        # the results tab is about to change, a saved state would no longer describe it (an incremental run saves a
+        # new one once everything is written)
+        ReportState.delete(bavli_sheet.id, external_sheet.id)
+
+        previous_rows = None
+        if existing_worksheet and previous_state and previous_state.worksheet_id == existing_worksheet.id and previous_state.rows:
+            # patch the last report in place instead of writing a whole new one
+            worksheet = existing_worksheet
+            start_row, previous_rows = previous_state.first_row, previous_state.rows
+            fit_worksheet(worksheet, start_row - 1 + max(rows, len(previous_rows)), cols)
+        else:
+            logging_func("Shit is smelling good! Im creating a new sheet for the report now")
+            # sized for exactly what is about to be written, an older report is kept in a dated tab (or cleared)
+            worksheet = provision_worksheet(
+                bavli_sheet, REPORT_RESULTS, LEGEND_ROWS + rows, cols, existing=existing_worksheet, rotate=rotate
+            )
+            start_row = 1
+
+        new_writer = ReportWriter(
+            worksheet, start_row=start_row, previous=previous_rows, keep_rows=incremental, base_revision=base_revision
+        )
+        new_writer.add_legend()
+        return new_writer
 
+    # every section is written in the background as soon as it is laid out, while the next one is
+    pipeline = WritePipeline(open_writer)
     try:
-        logging_func("Shit is smelling good! Im creating a new sheet for the report now")
-        new_worksheet = bavli_sheet.worksheet("Report results")
-    except WorksheetNotFound:
-        new_worksheet = create_worksheet(bavli_sheet, rows=(
-            len(mismatches) + len(all_matches)*2 + len(invalids) + len(outliers) + 150
-        ))
-
-    write_legend(new_worksheet)
-
-    vals_to_write = format_to_gsheet_values(mismatches)
-    formats = get_formatting_settings(vals_to_write, (BackgroundColor.RED, BackgroundColor.LIGHT_RED))
-    write_values(sheet=new_worksheet, values=vals_to_write, formatting=formats)
-
-    vals_to_write = format_to_gsheet_values(outliers)
-    formats = get_formatting_settings(vals_to_write, (BackgroundColor.PURPLE, BackgroundColor.WHITE))
-    write_values(sheet=new_worksheet, values=vals_to_write, formatting=formats)
-
-    vals_to_write = format_to_gsheet_values(invalids)
-    formats = get_formatting_settings(vals_to_write, (BackgroundColor.ORANGE, BackgroundColor.WHITE))
-    write_values(sheet=new_worksheet, values=vals_to_write, formatting=formats)
+        grouped = group_values(mismatches)
+        pipeline.add_values(grouped.rows, (BackgroundColor.RED, BackgroundColor.LIGHT_RED), group_ends=grouped.group_ends)
+        matched_values, cell_colors = format_matched_diffs(keyed_matches, diffs)
+        pipeline.add_values(matched_values, (BackgroundColor.LIGHT_GREEN, BackgroundColor.WHITE), cell_colors)
+        grouped = group_values(outliers)
+        pipeline.add_values(grouped.rows, (BackgroundColor.PURPLE, BackgroundColor.WHITE), group_ends=grouped.group_ends)
+        grouped = group_values(invalids)
+        pipeline.add_values(grouped.rows, (BackgroundColor.ORANGE, BackgroundColor.WHITE), group_ends=grouped.group_ends)
+
+        stage("write")
+        logging_func("Writing everything to the sheet")
+        writer = pipeline.close(progress=lambda done, total: progress_func("write", done, total))
+    except BaseException:
+        pipeline.cancel()
+        raise
+    new_worksheet = writer.sheet
+
+    if incremental:
+        # only kept for the next incremental run, a plain run does not pay for it
+        stage("save state")
+        state.worksheet_id, state.first_row, state.rows = new_worksheet.id, writer.first_row, writer.rows
+        state.save(bavli_sheet.id, external_sheet.id)
+    metrics.finish()
 
     if show_matches:
         pass
@@ -157,6 +444,13 @@ def do_report_work(
         f"{TAB}There are {len(mismatches)} mismatches marked red and light red. You should go over them to see whats wrong.",
         level=logging.ERROR
     )
+    logging_func(
+        f"{TAB}There are {diffed_matches} matched rows that differ in some fields, the differing cells are marked yellow.",
+        level=logging.WARNING
+    )
+    for i, count in enumerate(diffs.column_counts):
+        if count:
+            logging_func(f"{TAB}{TAB}Column {Range.int_to_column(4 + i)} differs in {count} matched rows", level=logging.WARNING)
     logging_func(
         f"{TAB}There are {len(outliers)} rows marked in purple. Those bitches are found in one sheet but not the other for some reason",
         level=logging.DEBUG
@@ -170,3 +464,11 @@ def do_report_work(
             f"{TAB}There are {len(all_matches)} matched rows! Wohoo, those are marked light green and are matching. Note that some might different values in some parts(such as `notes`)",
             level=logging.NOTSET
         )
+
+    return ReportSummary(
+        mismatches=len(mismatches),
+        outliers=len(outliers),
+        invalids=len(invalids),
+        matches=len(all_matches),
+        diffs=diffed_matches
+    )
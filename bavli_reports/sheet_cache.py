@@ -0,0 +1,112 @@
+import gzip
+import json
+import os
+import threading
+from logging import getLogger
+from typing import List, Dict, Optional, Iterable, Iterator
+
+from bavli_reports import ROOT_DIR
+
+logger = getLogger(__name__)
+
+CACHE_DIR = os.path.join(ROOT_DIR, ".sheet_cache")
+
+
+class SheetCache:
+    """On disk snapshots of worksheet values, keyed by spreadsheet id + worksheet id
+
+    Each snapshot is stamped with the spreadsheet's Drive revision and is only handed back while that revision
+    is still current. The values live in a gzipped json-lines file (one row per line, so they can be streamed in
+    and out) and the revision in a tiny file next to it, so re-stamping a snapshot never rewrites the values.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR):
+        self.directory = directory
+        # the revision each spreadsheet had the last time we validated it
+        self._seen: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, spreadsheet_id: str, worksheet_id: int, ext: str) -> str:
+        return os.path.join(self.directory, f"{spreadsheet_id}_{worksheet_id}.{ext}")
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_rows(f) -> Iterator[List]:
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+    def get(self, spreadsheet_id: str, worksheet_id: int, revision: str) -> Optional[Iterator[List]]:
+        with self._lock:
+            self._seen[spreadsheet_id] = revision
+
+        try:
+            with open(self._path(spreadsheet_id, worksheet_id, "rev"), "r") as f:
+                if f.read() != revision:
+                    return None
+            return self._read_rows(gzip.open(self._path(spreadsheet_id, worksheet_id, "jsonl.gz"), "rt", encoding="utf-8"))
+        except OSError:
+            return None
+
+    def put(self, spreadsheet_id: str, worksheet_id: int, revision: str, values: Iterable[List]) -> Iterator[List]:
+        """Yields `values` back while writing them, the snapshot is only committed once they are exhausted"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(spreadsheet_id, worksheet_id, "jsonl.gz")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for row in values:
+                f.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")))
+                f.write("\n")
+                yield row
+
+        os.replace(tmp_path, path)
+        self._write(self._path(spreadsheet_id, worksheet_id, "rev"), revision.encode("utf-8"))
+
+    def restamp(self, spreadsheet_id: str, revision: str, base_revision: Optional[str]):
+        """Moves every snapshot of the last seen revision to `revision`
+
+        Meant to be called after we wrote to the spreadsheet ourselves (e.g. the report results), since that
+        bumps the revision without touching the worksheets we have cached. `base_revision` is the revision read
+        right before our first write, when it is not the one the snapshots were stamped with someone else edited
+        the spreadsheet in between, and since there is no telling which worksheets they touched the snapshots are
+        dropped instead.
+        """
+        with self._lock:
+            old_revision = self._seen.get(spreadsheet_id)
+            self._seen[spreadsheet_id] = revision
+        if old_revision is None or not os.path.isdir(self.directory):
+            return
+
+        for path in self._snapshots(spreadsheet_id, old_revision):
+            try:
+                if base_revision == old_revision:
+                    self._write(path, revision.encode("utf-8"))
+                else:
+                    os.remove(path)
+                    os.remove(f"{path[:-len('.rev')]}.jsonl.gz")
+            except OSError as e:
+                logger.warning(f"Could not update cached sheet {os.path.basename(path)}: {e}")
+
+    def _snapshots(self, spreadsheet_id: str, revision: str) -> Iterator[str]:
+        """The revision files of every snapshot of `spreadsheet_id` stamped with `revision`"""
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith(f"{spreadsheet_id}_") and filename.endswith(".rev")):
+                continue
+
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path, "r") as f:
+                    if f.read() == revision:
+                        yield path
+            except OSError as e:
+                logger.warning(f"Could not read cached sheet {filename}: {e}")
+
+    def seen(self, spreadsheet_id: str) -> bool:
+        with self._lock:
+            return spreadsheet_id in self._seen
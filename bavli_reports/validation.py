@@ -0,0 +1,175 @@
+import dataclasses
+import json
+import os
+import re
+import threading
+from collections import Counter
+from itertools import islice, compress
+from logging import getLogger
+from operator import itemgetter, not_, and_
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Callable
+
+from bavli_reports import ROOT_DIR
+
+logger = getLogger(__name__)
+
+RULES_FILE = os.path.join(ROOT_DIR, "validation_rules.json")
+# how many rows are validated together, a column at a time
+BATCH_SIZE: int = 5000
+# how many values a rule remembers the outcome of, bounded since the GUI and the batch runner live through many reports
+MEMO_SIZE: int = 2 ** 16
+
+TYPE_PATTERNS: Dict[str, str] = {
+    # whatever `int()` takes, surrounding whitespace and sign included
+    "int": r"\s*[+-]?\d+\s*",
+    "number": r"\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*",
+    "str": r".*",
+}
+
+
+@dataclasses.dataclass
+class ColumnRule:
+    """What the value in the (0-based) `column` of a row must look like
+
+    A value must be of `type` (see `TYPE_PATTERNS`) and, when given, fully match `pattern`. An empty value only
+    passes when the column is not `required`.
+    """
+    column: int
+    name: str = None
+    type: str = "str"
+    pattern: str = None
+    required: bool = False
+
+    def __post_init__(self):
+        if self.type not in TYPE_PATTERNS:
+            raise ValueError(f"unknown type {self.type!r} for column {self.column}, expected one of {list(TYPE_PATTERNS)}")
+        self.name = self.name or f"column {self.column + 1}"
+
+
+# what a row has always been checked for: house number and zip code are both numbers
+DEFAULT_RULES: List[ColumnRule] = [
+    ColumnRule(column=1, name="house", type="int", required=True),
+    ColumnRule(column=2, name="zip", type="int", required=True),
+]
+
+
+class _Memo(dict):
+    """Remembers the outcome of `check` for the last (up to `MEMO_SIZE`) values it was asked about, report columns
+    repeat a lot
+
+    A plain dict that starts over once full, looking values up is what validation spends its time on and an
+    `lru_cache` is twice as slow at it.
+    """
+
+    def __init__(self, check: Callable[[str], bool]):
+        super().__init__()
+        self.check = check
+
+    def __missing__(self, value: str) -> bool:
+        if len(self) >= MEMO_SIZE:
+            self.clear()
+        self[value] = result = self.check(value)
+        return result
+
+
+def _compile_rule(rule: ColumnRule) -> _Memo:
+    type_pattern = re.compile(TYPE_PATTERNS[rule.type], re.DOTALL)
+    pattern = rule.pattern and re.compile(rule.pattern, re.DOTALL)
+
+    def check(value: str) -> bool:
+        if not value:
+            return not rule.required
+        return bool(type_pattern.fullmatch(value)) and (not pattern or bool(pattern.fullmatch(value)))
+
+    return _Memo(check)
+
+
+class RowValidator:
+    """A set of `ColumnRule`s compiled once and applied to whole batches of rows, one column at a time
+
+    Rows whose required columns are all empty are blank and are dropped. Instead of logging every bad row, the
+    number of rows failing each rule (and of blank rows) is added up in an `errors` counter.
+    """
+
+    def __init__(self, rules: List[ColumnRule] = None):
+        self.rules = rules or DEFAULT_RULES
+        self._checks = [_compile_rule(rule) for rule in self.rules]
+        self._required = [rule.column for rule in self.rules if rule.required]
+
+    @staticmethod
+    def _column(rows: List[List], column: int) -> List[str]:
+        try:
+            return list(map(itemgetter(column), rows))
+        except IndexError:
+            return [row[column] if len(row) > column else "" for row in rows]
+
+    def validate(self, rows: List[List], errors: Counter) -> Tuple[Optional[List[bool]], List[bool]]:
+        """Whether each row is blank (None when none of them are), and whether it is valid"""
+        columns = {column: self._column(rows, column) for column in {rule.column for rule in self.rules}}
+        blank = None
+        # a row is only blank when all of its required values are empty, one full column rules that out for all
+        if self._required and not any(map(all, (columns[column] for column in self._required))):
+            blank = list(map(not_, map(any, zip(*(columns[column] for column in self._required)))))
+            skipped = sum(blank)
+            if skipped:
+                errors["blank"] += skipped
+            else:
+                blank = None
+
+        valid = None
+        for rule, check in zip(self.rules, self._checks):
+            passed = list(map(check.__getitem__, columns[rule.column]))
+            failed = passed.count(False)
+            if blank is not None:
+                failed -= sum(map(and_, blank, map(not_, passed)))
+            # blank rows are dropped anyway, whatever they failed does not matter
+            if failed:
+                errors[f"invalid {rule.name}"] += failed
+                valid = passed if valid is None else list(map(and_, valid, passed))
+
+        return blank, valid or [True] * len(rows)
+
+    def iter_validate(self, values: Iterable[List], errors: Counter, batch_size: int = BATCH_SIZE) -> Iterator[Tuple[bool, List]]:
+        """(is valid, row) for every row of `values` that is not blank, validated `batch_size` rows at a time"""
+        values = iter(values)
+        while True:
+            rows = list(islice(values, batch_size))
+            if not rows:
+                return
+            blank, valid = self.validate(rows, errors)
+            yield from zip(valid, rows) if blank is None else compress(zip(valid, rows), map(not_, blank))
+
+
+def load_rules(path: str = RULES_FILE) -> List[ColumnRule]:
+    """The rules listed under `rules` in a json file, e.g. `{"rules": [{"column": 1, "type": "int"}]}`"""
+    with open(path, encoding="utf-8") as f:
+        return [ColumnRule(**rule) for rule in json.load(f)["rules"]]
+
+
+# the rules file (None for the default rules) -> its modification time and validator, only the latest is kept
+_validators: Dict[Optional[str], Tuple[float, RowValidator]] = {}
+_validators_lock = threading.Lock()
+
+
+def get_validator(path: str = RULES_FILE) -> RowValidator:
+    """The validator for the rules in `path` (or the default rules, when there is no such file), only compiled
+    again once the file changes"""
+    try:
+        rules_path, mtime = path, os.path.getmtime(path)
+    except OSError:
+        rules_path, mtime = None, 0.0
+
+    with _validators_lock:
+        cached = _validators.get(rules_path)
+        if cached is None or cached[0] != mtime:
+            cached = _validators[rules_path] = mtime, RowValidator(rules_path and load_rules(path))
+        return cached[1]
+
+
+def format_errors(errors: Counter) -> Optional[str]:
+    if not errors:
+        return None
+    return ", ".join(
+        f"{count} blank rows skipped" if reason == "blank" else f"{count} rows with an {reason}"
+        for reason, count in errors.most_common()
+    )
@@ -1,34 +1,65 @@
 import logging
 import queue
-import threading
-from threading import Thread
+from itertools import groupby
 from tkinter import ttk, DISABLED, NORMAL, NSEW
 from tkinter.scrolledtext import ScrolledText
 import tkinter as tk
 from tkinter import N, W, S, E, Tk, BooleanVar
 
-import validators
-
-from bavli_reports.report_worker import do_report_work
+# only what it takes to show the window, everything a report needs is imported lazily (see `prewarm`)
+from bavli_reports.jobs import JobManager, JobCancelled, prewarm
+from bavli_reports.prefetch import Prefetcher, is_valid_url, is_spreadsheet_url
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+job_manager = JobManager()
+prefetcher = Prefetcher()
+# how long typing has to pause before the urls are checked
+DEBOUNCE_MS = 300
+
 
-def thread_worker(**kwargs):
+def start_job():
     logger.info("Starting the magic... \U0001F52E \U00002728 \U0001F609")
 
     def logging_func(msg, level=logging.INFO):
         logger.log(level, msg)
 
-    def do_work():
-        try:
-            do_report_work(bavli_report_url=bavli_url.get(), external_report_url=external_url.get(),
-                           logging_func=logging_func)
-        except Exception as e:
-            logger.error(f"Oops something went wrong! {e}")
-
-    threading.Thread(target=do_work).start()
+    job_manager.submit(
+        bavli_report_url=bavli_url.get(), external_report_url=external_url.get(), logging_func=logging_func,
+        # whatever was opened while the urls were typed in is not opened again
+        prefetched=prefetcher.prefetched([bavli_url.get(), external_url.get()])
+    )
+    start_button["state"] = DISABLED
+    cancel_button["state"] = NORMAL
+    root.after(100, poll_job)
+
+
+def cancel_job():
+    logger.warning("Stopping... whatever was already written to the sheet stays there")
+    job_manager.cancel()
+    cancel_button["state"] = DISABLED
+
+
+def poll_job():
+    # Check every 100ms how far the running report got
+    job = job_manager.current
+    stage, done, total, fraction = job.progress()
+    progress_bar["value"] = fraction * 100
+    progress_label["text"] = stage and (f"{stage} {done}/{total}" if total else stage) or ""
+    if not job.finished():
+        root.after(100, poll_job)
+        return
+
+    if job.future.cancelled() or isinstance(job.future.exception(), JobCancelled):
+        logger.warning("Stopped!")
+    elif job.future.exception():
+        logger.error(f"Oops something went wrong! {job.future.exception()}")
+    else:
+        progress_bar["value"] = 100
+    progress_label["text"] = ""
+    cancel_button["state"] = DISABLED
+    check_both_url()
 
 
 class QueueHandler(logging.Handler):
@@ -46,7 +77,13 @@ class QueueHandler(logging.Handler):
 
 
 class ConsoleUi:
-    """Poll messages from a logging queue and display them in a scrolled text widget"""
+    """Poll messages from a logging queue and display them in a scrolled text widget
+
+    Everything queued since the last poll is rendered in one go, and only the last `MAX_LINES` lines are kept.
+    """
+
+    MAX_RECORDS_PER_POLL = 1000
+    MAX_LINES = 5000
 
     def __init__(self, frame):
         self.frame = frame
@@ -73,33 +110,77 @@ class ConsoleUi:
         # Start polling messages from the queue
         self.frame.after(100, self.poll_log_queue)
 
-    def display(self, record):
-        msg = self.queue_handler.format(record)
+    def display(self, records):
         self.scrolled_text.configure(state='normal')
-        self.scrolled_text.insert(tk.END, msg + '\n', record.levelname)
+        # records of the same level in a row share a single insert
+        for level, group in groupby(records, key=lambda record: record.levelname):
+            self.scrolled_text.insert(tk.END, "".join(self.queue_handler.format(r) + '\n' for r in group), level)
+        lines = int(self.scrolled_text.index('end-1c').split('.')[0])
+        if lines > self.MAX_LINES:
+            self.scrolled_text.delete('1.0', f'{lines - self.MAX_LINES}.0')
         self.scrolled_text.configure(state='disabled')
         # Autoscroll to the bottom
         self.scrolled_text.yview(tk.END)
 
     def poll_log_queue(self):
-        # Check every 100ms if there is a new message in the queue to display
-        while True:
+        # Check every 100ms if there are new messages in the queue to display
+        records = []
+        while len(records) < self.MAX_RECORDS_PER_POLL:
             try:
-                record = self.log_queue.get(block=False)
+                records.append(self.log_queue.get(block=False))
             except queue.Empty:
                 break
-            else:
-                self.display(record)
+        if records:
+            self.display(records)
         self.frame.after(100, self.poll_log_queue)
 
 
 if __name__ == "__main__":
     urls = []
+    pending_check = None
+
+
+    def schedule_check():
+        # only check once typing (or pasting) paused for a bit
+        global pending_check
+        if pending_check is not None:
+            root.after_cancel(pending_check)
+        pending_check = root.after(DEBOUNCE_MS, check_both_url)
+
+
+    def show_sheets():
+        # Check every 200ms until every valid url was opened, then show what is in it
+        lines, pending = [], False
+        for name, url in zip(("Your sheet", "External sheet"), (url.get() for url in urls)):
+            if not is_spreadsheet_url(url):
+                continue
+            report, error = prefetcher.get(url), prefetcher.error(url)
+            if report:
+                lines.append(f"{name}: {report.spreadsheet.title} - {report.describe()}")
+            elif error:
+                lines.append(f"{name}: could not open it ({error})")
+            else:
+                lines.append(f"{name}: opening...")
+                pending = True
+        sheets_label["text"] = "\n".join(lines)
+        if pending:
+            root.after(200, show_sheets)
 
 
     def check_both_url():
+        global pending_check
+        pending_check = None
+        for url in urls:
+            # any other url would only fail, or worse, ask to sign in from the background
+            if is_spreadsheet_url(url.get()):
+                prefetcher.prefetch(url.get())
+        show_sheets()
+
+        if job_manager.busy:
+            start_button["state"] = DISABLED
+            return
         for url in urls:
-            if not validators.url(url.get()):
+            if not is_valid_url(url.get()):
                 start_button["state"] = DISABLED
                 return
         start_button["state"] = NORMAL
@@ -115,17 +196,21 @@ if __name__ == "__main__":
     content = ttk.Frame(root, padding=(3, 3, 12, 12))
     greeting_label = ttk.Label(content, text="Hi Guy, welcome to the reports master", anchor="center")
 
-    start_button = ttk.Button(content, text="Go!", state=DISABLED, command=thread_worker, style="Go.TButton")
+    start_button = ttk.Button(content, text="Go!", state=DISABLED, command=start_job, style="Go.TButton")
+    cancel_button = ttk.Button(content, text="Stop", state=DISABLED, command=cancel_job)
+    progress_bar = ttk.Progressbar(content, orient="horizontal", mode="determinate", maximum=100)
+    progress_label = ttk.Label(content, anchor="center")
 
     bavli_label = ttk.Label(content, text="Your sheet URL")
     bavli_string_var = tk.StringVar()
-    bavli_string_var.trace("w", lambda name, index, mode, sv=bavli_string_var: check_both_url())
+    bavli_string_var.trace("w", lambda name, index, mode, sv=bavli_string_var: schedule_check())
     bavli_url = ttk.Entry(content, textvariable=bavli_string_var)
     external_string_var = tk.StringVar()
-    external_string_var.trace("w", lambda name, index, mode, sv=bavli_string_var: check_both_url())
+    external_string_var.trace("w", lambda name, index, mode, sv=bavli_string_var: schedule_check())
     external_label = ttk.Label(content, text="External sheet URL")
     external_url = ttk.Entry(content, textvariable=external_string_var)
     urls.extend([bavli_url, external_url])
+    sheets_label = ttk.Label(content, justify="left")
 
     matches_var = BooleanVar(value=False)
     show_matches = ttk.Checkbutton(content, text="Show Matches", variable=matches_var, onvalue=True)
@@ -142,9 +227,13 @@ if __name__ == "__main__":
     external_url.grid(column=1, row=2, columnspan=2, sticky=(N, E, W), pady=5, padx=5)
 
     # show_matches.grid(column=0, row=3)
+    sheets_label.grid(column=1, row=3, columnspan=2, sticky=(N, W), padx=5)
 
     frame.grid(column=0, row=4, columnspan=3, rowspan=3, sticky=(N, S, E, W))
-    start_button.grid(column=1, row=7, sticky=(N, S, E, W))
+    progress_bar.grid(column=0, row=7, columnspan=3, sticky=(E, W), pady=5, padx=5)
+    progress_label.grid(column=0, row=8, columnspan=3, sticky=(E, W))
+    start_button.grid(column=1, row=9, sticky=(N, S, E, W))
+    cancel_button.grid(column=2, row=9, sticky=(N, S, E, W))
 
     root.columnconfigure(0, weight=1)
     root.rowconfigure(0, weight=1)
@@ -153,6 +242,9 @@ if __name__ == "__main__":
     content.rowconfigure(4, weight=1)
     content.rowconfigure(5, weight=1)
     content.rowconfigure(6, weight=1)
-    content.rowconfigure(7, weight=1)
+    content.rowconfigure(9, weight=1)
 
+    # load gspread and friends while the user is still pasting urls
+    root.after_idle(prewarm)
+    root.protocol("WM_DELETE_WINDOW", lambda: (job_manager.shutdown(), prefetcher.shutdown(), root.destroy()))
     root.mainloop()
@@ -0,0 +1,61 @@
+"""Fixtures for running reports against the in memory `LocalClient`, no Google account needed"""
+import uuid
+from typing import List, Tuple, Callable, Dict
+
+import pytest
+
+from bavli_reports import report_state
+from bavli_reports.benchmark import generate_sheets
+from bavli_reports.local_sheets import LocalClient, LocalSpreadsheet, LocalWorksheet
+from bavli_reports.report_worker import do_report_work
+
+
+def quiet(msg, level=None):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """Keeps the report state of the tests out of the real `.report_state`"""
+    monkeypatch.setattr(report_state, "STATE_DIR", str(tmp_path / "report_state"))
+
+
+@pytest.fixture
+def render() -> Callable[[LocalWorksheet], Tuple[List[List[str]], Dict[Tuple[int, int], dict]]]:
+    """What a worksheet looks like: its values and the background color of every cell"""
+    def rendered(worksheet: LocalWorksheet):
+        return worksheet.values(1, len(worksheet.rows)), worksheet.background_colors()
+
+    return rendered
+
+
+@pytest.fixture
+def sheets() -> Tuple[List[List], List[List]]:
+    """A small bavli and external sheet with some of every kind of row: mismatching, one-sided and invalid"""
+    return generate_sheets(600, rows_per_key=4, mismatch_rate=0.1, seed=7)
+
+
+@pytest.fixture
+def make_pair() -> Callable[[List[List], List[List]], Tuple[LocalClient, LocalSpreadsheet]]:
+    """Builds a client serving a "bavli" and an "external" spreadsheet (by those urls) with the given rows"""
+    def make(bavli_rows: List[List], external_rows: List[List]) -> Tuple[LocalClient, LocalSpreadsheet]:
+        client = LocalClient()
+        bavli = client.add("bavli", LocalSpreadsheet(title="bavli", spreadsheet_id=f"bavli-{uuid.uuid4().hex}"))
+        bavli.add_worksheet("bavli", values=[list(row) for row in bavli_rows])
+        external = client.add(
+            "external", LocalSpreadsheet(title="external", spreadsheet_id=f"external-{uuid.uuid4().hex}")
+        )
+        external.add_worksheet("external", values=[list(row) for row in external_rows])
+        return client, bavli
+
+    return make
+
+
+@pytest.fixture
+def run_report() -> Callable:
+    """Runs `do_report_work` on the pair of a `make_pair` client"""
+    def run(client: LocalClient, **kwargs):
+        kwargs.setdefault("logging_func", quiet)
+        return do_report_work("bavli", "external", connection=client, **kwargs)
+
+    return run
@@ -0,0 +1,110 @@
+"""Reading and writing worksheets, against the in memory `LocalClient`"""
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from bavli_reports import models, google_connection
+from bavli_reports.google_connection import _trim, iter_sheet_rows, ReportWriter, provision_worksheet
+from bavli_reports.local_sheets import LocalSpreadsheet
+from bavli_reports.report_worker import REPORT_RESULTS
+
+
+@pytest.fixture
+def worksheet():
+    rows = [["name", "house", "zip", "apartment", "notes"]]
+    for i in range(1, 23):
+        # whole runs of blank rows, some of them a whole chunk long, and rows ending in blank cells
+        rows.append([""] * 5 if i % 7 in (3, 4, 5) else [f"tenant {i}", str(i), "", "", ""])
+    rows += [["last", "1", "2", "3", ""], [""] * 5, [""] * 5]
+    return LocalSpreadsheet().add_worksheet("sheet", rows=30, values=rows)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4, 5, 7, 25, 26, 100])
+def test_iter_sheet_rows_matches_get_values(worksheet, chunk_size):
+    rows = list(iter_sheet_rows(worksheet, chunk_size))
+    # trailing blank rows are left out just like `get_values` leaves them out
+    assert rows == worksheet.get_values()
+    assert rows[-1][0] == "last"
+
+
+def test_iter_sheet_rows_of_an_empty_sheet():
+    assert list(iter_sheet_rows(LocalSpreadsheet().add_worksheet("empty", rows=10), 3)) == []
+
+
+@pytest.mark.parametrize("length", range(6))
+@pytest.mark.parametrize("head, tail", [(0, 0), (1, 2), (2, 1), (0, 3)])
+def test_trim_is_a_slice(length, head, tail):
+    values = list(range(length))
+    assert list(_trim(iter(values), head, tail)) == values[head:max(0, len(values) - tail)]
+
+
+def _write_sections(worksheet, sections, **kwargs):
+    writer = ReportWriter(worksheet, start_row=1, **kwargs)
+    writer.add_legend()
+    for values in sections:
+        writer.add_values(values)
+        writer.send_full_batches()
+    writer.flush()
+
+
+def test_report_writer_splits_big_sections_into_bounded_batches(monkeypatch):
+    spreadsheet = LocalSpreadsheet()
+    batches = []
+    values_batch_update = spreadsheet.values_batch_update
+
+    def record(params=None, body=None):
+        batches.append(body["data"])
+        return values_batch_update(params, body)
+
+    monkeypatch.setattr(spreadsheet, "values_batch_update", record)
+
+    values = [[f"tenant {i}", str(i), "מספר \"בית\"" * (i % 5)] for i in range(300)]
+    sections = [values[:100], [], values[100:]]
+    bounded = spreadsheet.add_worksheet("bounded", rows=10)
+    _write_sections(bounded, sections, max_bytes=2000)
+
+    assert len(batches) > 5
+    for data in batches:
+        assert sum(len(json.dumps(item, ensure_ascii=False)) for item in data) <= 2000
+
+    batches.clear()
+    whole = spreadsheet.add_worksheet("whole", rows=10)
+    _write_sections(whole, sections)
+    assert len(batches) == 1
+    assert bounded.get_values() == whole.get_values()
+
+
+def test_merged_formats_render_like_unmerged(sheets, make_pair, run_report, render, monkeypatch):
+    client, bavli = make_pair(*sheets)
+    run_report(client)
+    merged = bavli.worksheet(REPORT_RESULTS)
+
+    monkeypatch.setattr(models, "_merge_repeat_cell", lambda last, new: False)
+    client, bavli = make_pair(*sheets)
+    run_report(client)
+    unmerged = bavli.worksheet(REPORT_RESULTS)
+
+    assert len(merged.formats) < len(unmerged.formats)
+    assert render(merged) == render(unmerged)
+
+
+def test_rotated_titles_do_not_collide(tmp_path, monkeypatch):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2024, 1, 2, 3, 4, 5)
+
+    monkeypatch.setattr(google_connection, "datetime", FrozenDatetime)
+    spreadsheet = LocalSpreadsheet(title="bavli")
+    spreadsheet.add_worksheet("results")
+    for _ in range(3):
+        provision_worksheet(spreadsheet, "results", 10, 5, existing=spreadsheet.worksheet("results"))
+
+    assert [ws.title for ws in spreadsheet.worksheets()] == [
+        "results 2024-01-02 03-04-05", "results 2024-01-02 03-04-05 (2)", "results 2024-01-02 03-04-05 (3)", "results"
+    ]
+    # every worksheet makes a valid file name, on Windows too
+    spreadsheet.save(str(tmp_path / "bavli"))
+    assert len(os.listdir(tmp_path / "bavli")) == 4
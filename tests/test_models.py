@@ -0,0 +1,95 @@
+"""The building blocks in `bavli_reports.models`"""
+from typing import List
+
+import pytest
+from gspread.exceptions import APIError
+
+from bavli_reports import models
+from bavli_reports.engine import scan_by_key
+from bavli_reports.models import MatchIndex, RateLimiter
+
+
+def test_match_index_takes_duplicates_in_order():
+    rows = [["a", 1], ["b", 2], ["a", 3], ["a", 4]]
+    index = MatchIndex(rows)
+
+    assert index.pop_match(["a"]) == ["a", 1]
+    assert index.pop_match(["a"]) == ["a", 3]
+    assert index.pop_match(["c"]) == ()
+    assert index.remaining() == [["b", 2], ["a", 4]]
+    assert index.pop_match(["a"]) == ["a", 4]
+    assert index.pop_match(["a"]) == ()
+
+
+def test_scan_by_key_matches_like_a_linear_scan():
+    def linear_scan(bavli, external):
+        left, matches, unmatched = list(external), [], []
+        for row in bavli:
+            match = next((other for other in left if other[0] == row[0]), None)
+            if match is None:
+                unmatched.append(row)
+            else:
+                left.remove(match)
+                matches.append((row, match))
+        return unmatched, matches, left
+
+    bavli = [["x", "1"], ["y", "2"], ["x", "3"], ["z", "4"], ["x", "5"]]
+    external = [["x", "a"], ["w", "b"], ["x", "c"], ["y", "d"], ["y", "e"]]
+    unmatched, matches, left = linear_scan(bavli, external)
+
+    mismatches, diffs = scan_by_key(("key",), [bavli, external])
+    assert [(d.bavli_row, d.external_row) for d in diffs] == matches
+    assert mismatches == {("bavli", "key"): unmatched, ("external", "key"): left}
+
+
+class _Response:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+    def json(self):
+        return {"error": {"code": self.status_code}}
+
+
+class _Flaky:
+    """Fails with the given statuses, in order, then succeeds"""
+    def __init__(self, *statuses: int):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.statuses:
+            raise APIError(_Response(self.statuses.pop(0)))
+        return "ok"
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> List[float]:
+    slept = []
+    monkeypatch.setattr(models, "sleep", slept.append)
+    return slept
+
+
+@pytest.mark.parametrize("status", RateLimiter.RETRY_STATUSES)
+def test_rate_limiter_retries_throttling_and_server_errors(status, sleeps):
+    func = _Flaky(status, status)
+    assert RateLimiter(backoff=1, max_backoff=64).read(func) == "ok"
+    assert func.calls == 3
+    # exponential backoff with up to a second of jitter
+    assert len(sleeps) == 2 and 1 <= sleeps[0] < 2 and 2 <= sleeps[1] < 3
+
+
+@pytest.mark.parametrize("status", [400, 403, 404])
+def test_rate_limiter_does_not_retry_client_errors(status, sleeps):
+    func = _Flaky(status)
+    with pytest.raises(APIError):
+        RateLimiter().write(func)
+    assert func.calls == 1 and not sleeps
+
+
+def test_rate_limiter_gives_up_after_max_retries(sleeps):
+    func = _Flaky(*[503] * 4)
+    with pytest.raises(APIError):
+        RateLimiter(max_retries=2, backoff=100, max_backoff=5).read(func)
+    assert func.calls == 3
+    assert all(5 <= s < 6 for s in sleeps)
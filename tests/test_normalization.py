@@ -0,0 +1,66 @@
+"""Comparing keys and names the way they were meant, not the way they were typed"""
+import itertools
+
+import pytest
+
+from bavli_reports.normalization import normalize_key, normalize_text, edit_distance, FuzzyMatchIndex
+
+
+@pytest.mark.parametrize("key, expected", [
+    (("12", "1234"), ("12", "1234")),
+    (("012", "01234"), ("12", "1234")),
+    (("12A", "1234"), ("12a", "1234")),
+    (("12 א", "12 34"), ("12א", "1234")),
+    (("12-b", "12-34"), ("12b", "1234")),
+    (("12/ג", "1234"), ("12ג", "1234")),
+    ((" 7 ", "000"), ("7", "0")),
+    (("12ab", "1234"), None),
+    (("twelve", "1234"), None),
+    (("12", "12a"), None),
+    (("", "1234"), None),
+])
+def test_normalize_key(key, expected):
+    assert normalize_key(key) == expected
+
+
+def test_normalize_text():
+    assert normalize_text("  Herzl   ST ") == "herzl st"
+    assert normalize_text("שלום") == normalize_text("שלומ") == "שלומ"
+    assert normalize_text('ת"א') == "תא"
+    assert normalize_text("בָּיִת") == "בית"
+
+
+def _levenshtein(a: str, b: str) -> int:
+    if not a or not b:
+        return len(a) + len(b)
+    return min(
+        _levenshtein(a[1:], b) + 1, _levenshtein(a, b[1:]) + 1, _levenshtein(a[1:], b[1:]) + (a[0] != b[0])
+    )
+
+
+@pytest.mark.parametrize("a, b", list(itertools.product(["", "a", "ab", "abc", "kitten", "sitting", "axc"], repeat=2)))
+@pytest.mark.parametrize("max_distance", [0, 1, 2, 5])
+def test_edit_distance_gives_up_past_max_distance(a, b, max_distance):
+    assert edit_distance(a, b, max_distance) == min(_levenshtein(a, b), max_distance + 1)
+
+
+def test_pop_closest_takes_the_closest_untaken_row():
+    rows = [["israel israeli", 1], ["israel israeli", 2], ["isreal israeli", 3], ["moshe cohen", 4]]
+    index = FuzzyMatchIndex(rows)
+
+    # an exact match is an edit distance of 0, the first one on a tie
+    assert index.pop_closest(["Israel  Israeli"]) == rows[0]
+    assert index.pop_closest(["israel israel"]) == rows[1]
+    assert index.pop_closest(["isreal israel"]) == rows[2]
+    # nothing close enough is left
+    assert index.pop_closest(["israel israel"]) == ()
+    assert index.pop_closest(["moshe"]) == ()
+    # taken rows are not matched exactly either
+    assert index.pop_match(["israel israeli"]) == ()
+    assert index.remaining() == [rows[3]]
+
+
+def test_pop_closest_needs_a_long_enough_value():
+    index = FuzzyMatchIndex([["dan"]])
+    assert index.pop_closest(["dam"]) == ()
+    assert index.pop_match(["DAN"]) == ["dan"]
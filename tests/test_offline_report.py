@@ -0,0 +1,84 @@
+"""End to end report runs against the in memory `LocalClient`"""
+from bavli_reports.google_connection import DELIMITER, LEGEND_ROWS
+from bavli_reports.report_state import ReportState
+from bavli_reports.report_worker import REPORT_RESULTS
+
+
+def test_report_runs_offline(sheets, make_pair, run_report, render):
+    client, bavli = make_pair(*sheets)
+    summary = run_report(client)
+
+    rows, colors = render(bavli.worksheet(REPORT_RESULTS))
+    # the legend, then the mismatches, matched, outliers and invalids sections, each followed by a separator
+    separators = [i for i, row in enumerate(rows) if row == [DELIMITER] and i >= LEGEND_ROWS]
+    assert len(separators) == 4 and separators[-1] == len(rows) - 1
+    assert summary.mismatches and summary.outliers and summary.invalids and summary.diffs
+    assert colors
+    # the sources are left untouched
+    assert [ws.title for ws in bavli.worksheets()] == ["bavli", REPORT_RESULTS]
+    assert client.open_by_url("external").worksheet("external").get_values()[1:-2] == [
+        list(row) for row in sheets[1][1:-2]
+    ]
+
+
+def _edit(worksheet):
+    """A few notes fixed, a tenant gone and a new building"""
+    worksheet.rows[5][4] = "fixed"
+    worksheet.rows[40][4] = "fixed"
+    del worksheet.rows[80]
+    worksheet.rows.insert(-2, ["new tenant", "9999", "1234", "apartment 1", "ok"])
+
+
+def test_incremental_patch_matches_a_fresh_run(sheets, make_pair, run_report, render):
+    client, bavli = make_pair(*sheets)
+    run_report(client, incremental=True)
+
+    source = bavli.worksheet("bavli")
+    _edit(source)
+    messages = []
+    run_report(client, incremental=True, logging_func=lambda msg, level=None: messages.append(msg))
+    assert any("keys changed since the last run" in msg for msg in messages)
+    # patched in place, nothing was rotated away
+    assert [ws.title for ws in bavli.worksheets()] == ["bavli", REPORT_RESULTS]
+
+    fresh_client, fresh_bavli = make_pair(source.get_values(), sheets[1])
+    run_report(fresh_client)
+    assert render(bavli.worksheet(REPORT_RESULTS)) == render(fresh_bavli.worksheet(REPORT_RESULTS))
+
+
+def test_plain_runs_keep_no_state(sheets, make_pair, run_report):
+    client, bavli = make_pair(*sheets)
+    run_report(client)
+    assert ReportState.load(bavli.id, client.open_by_url("external").id) is None
+
+
+def test_plain_run_in_between_drops_the_incremental_state(sheets, make_pair, run_report, render):
+    client, bavli = make_pair(*sheets)
+    source = bavli.worksheet("bavli")
+    original = [list(row) for row in source.rows]
+    run_report(client, incremental=True)
+
+    # the same results tab written over by a plain run of other data
+    _edit(source)
+    run_report(client, rotate=False)
+    assert ReportState.load(bavli.id, client.open_by_url("external").id) is None
+
+    source.rows = original
+    run_report(client, incremental=True)
+
+    fresh_client, fresh_bavli = make_pair(*sheets)
+    run_report(fresh_client)
+    assert render(bavli.worksheet(REPORT_RESULTS)) == render(fresh_bavli.worksheet(REPORT_RESULTS))
+
+
+def test_processes_match_a_single_process_run(sheets, make_pair, run_report, render):
+    client, bavli = make_pair(*sheets)
+    single = run_report(client, rotate=False)
+    single_rows = render(bavli.worksheet(REPORT_RESULTS))
+
+    client, bavli = make_pair(*sheets)
+    sharded = run_report(client, rotate=False, processes=2)
+
+    assert render(bavli.worksheet(REPORT_RESULTS)) == single_rows
+    assert (sharded.mismatches, sharded.outliers, sharded.invalids, sharded.matches, sharded.diffs) == \
+        (single.mismatches, single.outliers, single.invalids, single.matches, single.diffs)
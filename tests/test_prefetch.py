@@ -0,0 +1,56 @@
+"""Opening spreadsheets in the background while their urls are typed in"""
+import pytest
+
+from bavli_reports.prefetch import Prefetcher, is_spreadsheet_url
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://docs.google.com/spreadsheets/d/1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms/edit#gid=0", True),
+    ("https://example.com/some/page", False),
+    ("docs.google.com/spreadsheets/d/1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms", False),
+    ("", False),
+])
+def test_only_spreadsheet_urls_are_prefetched(url, expected):
+    assert is_spreadsheet_url(url) is expected
+
+
+class _CountingPrefetcher(Prefetcher):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.fetched = []
+
+    def _fetch(self, url: str):
+        self.fetched.append(url)
+        return super()._fetch(url)
+
+
+@pytest.fixture
+def prefetcher(make_pair, sheets):
+    client, _ = make_pair(*sheets)
+    prefetcher = _CountingPrefetcher(connection=client)
+    yield prefetcher
+    prefetcher.shutdown()
+
+
+def test_failures_are_not_retried_right_away(prefetcher):
+    prefetcher.prefetch("missing").exception(timeout=5)
+    prefetcher.prefetch("missing")
+    assert prefetcher.fetched == ["missing"]
+    assert prefetcher.get("missing") is None and prefetcher.error("missing") is not None
+
+    # until `retry_after` passed
+    prefetcher.retry_after = 0
+    prefetcher.prefetch("missing").exception(timeout=5)
+    assert prefetcher.fetched == ["missing", "missing"]
+
+
+def test_reports_are_fetched_once_while_fresh(prefetcher):
+    report = prefetcher.prefetch("bavli").result(timeout=5)
+    prefetcher.prefetch("bavli")
+    assert prefetcher.get("bavli") is report and prefetcher.error("bavli") is None
+    assert prefetcher.fetched == ["bavli"]
+
+    prefetcher.max_age = 0
+    assert prefetcher.get("bavli") is None
+    assert prefetcher.prefetch("bavli").result(timeout=5) is not report
+    assert prefetcher.prefetched(["bavli", "external"]) == {}
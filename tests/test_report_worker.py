@@ -0,0 +1,118 @@
+"""Laying out the report sections and writing them"""
+import random
+from typing import List, Dict, Tuple
+
+import pytest
+
+from bavli_reports import report_worker
+from bavli_reports.google_connection import DELIMITER, LEGEND_ROWS
+from bavli_reports.models import BackgroundColor
+from bavli_reports.report_worker import WritePipeline, group_values, get_formatting_settings, REPORT_RESULTS
+
+COLORS = (BackgroundColor.RED, BackgroundColor.LIGHT_RED)
+
+
+def _old_format_to_gsheet_values(values: Dict[Tuple, List]) -> List[List]:
+    """How sections were laid out before `group_values`: flattened, then sorted on whole rows"""
+    to_return = []
+    for k, v in values.items():
+        for row in v if type(v) == list else [v]:
+            to_return.append([*k, *row])
+    return sorted(to_return, key=lambda x: tuple(x[1:]))
+
+
+def _old_group_ends(values: List[List]) -> List[int]:
+    ends = [i for i in range(1, len(values)) if values[i][1:3] != values[i - 1][1:3]]
+    return ends + [len(values)] if values else []
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_group_values_matches_the_old_sort(seed):
+    rng = random.Random(seed)
+    values = {}
+    for _ in range(rng.randint(0, 40)):
+        key = (rng.choice(["bavli", "external"]), str(rng.randint(1, 6)), str(rng.randint(1, 3)))
+        values[key] = [[rng.choice("ab"), str(rng.randint(0, 3))] for _ in range(rng.randint(0, 3))]
+
+    grouped = group_values(values)
+    assert grouped.rows == _old_format_to_gsheet_values(values)
+    assert grouped.group_ends == _old_group_ends(grouped.rows)
+
+    with_ends = get_formatting_settings(grouped.rows, COLORS, grouped.group_ends)
+    rediscovered = get_formatting_settings(grouped.rows, COLORS)
+    assert [(str(r), c) for r, c in with_ends] == [(str(r), c) for r, c in rediscovered]
+
+
+def test_report_sections_are_sorted_like_before(sheets, make_pair, run_report, render):
+    client, bavli = make_pair(*sheets)
+    summary = run_report(client)
+
+    rows, _ = render(bavli.worksheet(REPORT_RESULTS))
+    # a separator row after each of the mismatches, matched, outliers and invalids sections
+    sections, section = [], []
+    for row in rows[LEGEND_ROWS:]:
+        if row == [DELIMITER]:
+            sections.append(section)
+            section = []
+        else:
+            section.append(row)
+    mismatches, _, outliers, invalids = sections
+
+    assert summary.mismatches and summary.outliers and summary.invalids
+    for section in (mismatches, outliers, invalids):
+        assert section and section == sorted(section, key=lambda x: tuple(x[1:]))
+
+
+class _RecordingWriter:
+    def __init__(self):
+        self.calls: List[str] = []
+
+    def add_values(self, values, formatting=None, cell_colors=None):
+        self.calls.append(f"add {values[0][0]}")
+
+    def send_full_batches(self):
+        self.calls.append("send")
+
+    def flush(self, progress=None):
+        self.calls.append("flush")
+
+
+def test_write_pipeline_writes_every_section_then_flushes():
+    writer = _RecordingWriter()
+    pipeline = WritePipeline(lambda: writer)
+    for name in ("first", "second"):
+        pipeline.add_values([[name, "1", "2"]], COLORS)
+    assert pipeline.close() is writer
+    assert writer.calls == ["add first", "send", "add second", "send", "flush"]
+
+
+def test_write_pipeline_stops_at_the_first_failed_section(monkeypatch):
+    get_formatting_settings = report_worker.get_formatting_settings
+
+    def failing(values, colors, group_ends=None):
+        if values[0][0] == "second":
+            raise ValueError("no formatting for you")
+        return get_formatting_settings(values, colors, group_ends)
+
+    monkeypatch.setattr(report_worker, "get_formatting_settings", failing)
+    writer = _RecordingWriter()
+    pipeline = WritePipeline(lambda: writer)
+    for name in ("first", "second", "third"):
+        pipeline.add_values([[name, "1", "2"]], COLORS)
+
+    with pytest.raises(ValueError, match="no formatting for you"):
+        pipeline.close()
+    pipeline.cancel()
+    # neither the sections after it (written up in its rows) nor the flush
+    assert writer.calls == ["add first", "send"]
+
+
+def test_write_pipeline_writes_nothing_when_opening_the_writer_failed():
+    def open_writer():
+        raise RuntimeError("no sheet")
+
+    pipeline = WritePipeline(open_writer)
+    pipeline.add_values([["first", "1", "2"]], COLORS)
+    with pytest.raises(RuntimeError, match="no sheet"):
+        pipeline.close()
+    pipeline.cancel()
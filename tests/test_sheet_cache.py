@@ -0,0 +1,18 @@
+"""The on disk cache of fetched worksheets"""
+from bavli_reports.sheet_cache import SheetCache
+
+
+def test_sheet_cache_drops_snapshots_edited_by_someone_else(tmp_path):
+    cache = SheetCache(str(tmp_path))
+    list(cache.put("sheet", 1, "v1", [["a"]]))
+    assert list(cache.get("sheet", 1, "v1")) == [["a"]]
+
+    # someone edited (v2) before we wrote the report (v3)
+    cache.restamp("sheet", "v3", base_revision="v2")
+    assert cache.get("sheet", 1, "v3") is None
+
+    list(cache.put("sheet", 1, "v3", [["b"]]))
+    assert list(cache.get("sheet", 1, "v3")) == [["b"]]
+    # only our own write in between
+    cache.restamp("sheet", "v4", base_revision="v3")
+    assert list(cache.get("sheet", 1, "v4")) == [["b"]]
@@ -0,0 +1,71 @@
+"""Row validation with `ColumnRule`s"""
+import itertools
+import json
+import os
+from collections import Counter
+from typing import List
+
+from bavli_reports import validation
+from bavli_reports.validation import RowValidator, get_validator
+
+
+def _default_filter(row: List) -> bool:
+    """How rows were checked before there were rules, a row with neither a house nor a zip code raised"""
+    house, zip_code = row[1:3]
+    if house or zip_code:
+        try:
+            int(house)
+            int(zip_code)
+        except ValueError:
+            return False
+        else:
+            return True
+    raise ValueError(f"invalid row -> both identifiers are empty: ({house}, {zip_code})")
+
+
+# `int()` also takes "1_0", nobody types a house number like that
+VALUES = ["", "12", " 7 ", "+3", "-0", "0012", "12a", "a", "١٢", "1.5", "\n4\n", "1 2", "--1"]
+
+
+def test_default_rules_check_rows_like_default_filter():
+    rows = [["name", house, zip_code, "apartment"] for house, zip_code in itertools.product(VALUES, repeat=2)]
+    expected = []
+    for row in rows:
+        try:
+            expected.append((_default_filter(row), row))
+        except ValueError:
+            pass
+
+    errors = Counter()
+    # batches small enough that some of them are all blank and some have no blank row at all
+    assert list(RowValidator().iter_validate(iter(rows), errors, batch_size=3)) == expected
+    assert errors["blank"] == 1
+    assert errors["invalid house"] + errors["invalid zip"] >= len(rows) - 1 - sum(valid for valid, _ in expected)
+
+
+def test_memo_is_bounded(monkeypatch):
+    monkeypatch.setattr(validation, "MEMO_SIZE", 10)
+    validator = RowValidator()
+    rows = [["name", str(i), str(i)] for i in range(100)]
+    assert all(valid for valid, _ in validator.iter_validate(rows, Counter()))
+    assert all(len(check) <= 10 for check in validator._checks)
+
+
+def test_get_validator_only_keeps_the_latest_rules(tmp_path, monkeypatch):
+    monkeypatch.setattr(validation, "_validators", {})
+    path = str(tmp_path / "rules.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"rules": [{"column": 1, "type": "int"}]}, f)
+
+    first = get_validator(path)
+    assert get_validator(path) is first
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"rules": [{"column": 2, "type": "int"}]}, f)
+    os.utime(path, (0, 1))
+    second = get_validator(path)
+    assert second is not first and second.rules[0].column == 2
+    assert len(validation._validators) == 1
+
+    assert get_validator(str(tmp_path / "missing.json")).rules == validation.DEFAULT_RULES
+    assert len(validation._validators) == 2